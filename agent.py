@@ -0,0 +1,574 @@
+import argparse
+import asyncio
+import grp
+import hashlib
+import hmac
+import json
+import os
+import pwd
+import secrets
+import socket
+import struct
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from process import OutputTail, Process, user_options
+
+
+# Frames are a 4 byte big endian length followed by that many bytes of utf-8 json
+# After the tcp handshake the json is preceded by its 32 byte hmac
+FRAME_HEADER = struct.Struct(">I")
+SEQUENCE = struct.Struct(">Q")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+DEFAULT_SOCKET = "/run/discord-linuxgsm/agent.sock"
+HANDSHAKE_TIMEOUT = 10
+
+
+##############
+#  Protocol  #
+##############
+
+
+# Handshake over tcp, both sides prove they know the token without sending it
+#   agent  {"type": "challenge", "nonce": "<agent nonce>"}
+#   client {"type": "auth", "nonce": "<client nonce>", "mac": sign(token, "client", agent nonce, client nonce)}
+#   agent  {"type": "ready", "mac": sign(token, "agent", client nonce, agent nonce)}
+# Every frame after it is signed with a key for the session, see Session
+# Requests
+#   {"type": "run", "id": 1, "argv": ["./csgoserver", "restart"], "cwd": "/home/arena", "user": "arena"}
+#   {"type": "cancel", "id": 1, "grace": 5}
+# Responses
+#   {"type": "started", "id": 1}
+#   {"type": "line", "id": 1, "stream": "stdout", "line": "..."}
+#   {"type": "exit", "id": 1, "returncode": 0}
+#   {"type": "error", "id": 1, "message": "...", "missing": false}
+
+
+# Class that signs and checks the frames of an authenticated tcp connection
+# The key is made from the token and both nonces of the handshake, so frames of another connection don't fit
+# Every frame includes its direction and number, frames can't be replayed, reordered, dropped or sent back
+class Session():
+    def __init__(self, token:str, agent_nonce:str, client_nonce:str, side:str) -> None:
+        self.key = hmac.new(token.encode(), f"session/{agent_nonce}/{client_nonce}".encode(), hashlib.sha256).digest()
+        self.side = side
+        self.other_side = "client" if side == "agent" else "agent"
+        self.sent = 0
+        self.received = 0
+
+    def mac(self, side:str, number:int, data:bytes) -> bytes:
+        return hmac.new(self.key, side.encode() + SEQUENCE.pack(number) + data, hashlib.sha256).digest()
+
+    # Returns the data with its hmac in front
+    def seal(self, data:bytes) -> bytes:
+        self.sent += 1
+        return self.mac(self.side, self.sent, data) + data
+
+    # Returns the data without its hmac, raises ValueError if it wasn't sent by the other side
+    def open(self, payload:bytes) -> bytes:
+        self.received += 1
+        mac, data = payload[:32], payload[32:]
+        if not hmac.compare_digest(mac, self.mac(self.other_side, self.received, data)):
+            raise ValueError("Frame with a wrong signature")
+
+        return data
+
+
+# Returns a frame for a message
+def encode_frame(message:dict, session:Optional[Session]=None) -> bytes:
+    data = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+    if session is not None:
+        data = session.seal(data)
+
+    return FRAME_HEADER.pack(len(data)) + data
+
+# Returns the hmac of the parts of a handshake
+def sign(token:str, *parts:str) -> str:
+    return hmac.new(token.encode(), "/".join(parts).encode(), hashlib.sha256).hexdigest()
+
+# Reads a single frame, returns None when the connection is closed
+async def read_frame(reader:asyncio.StreamReader, session:Optional[Session]=None) -> Optional[dict]:
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        (size,) = FRAME_HEADER.unpack(header)
+        if size > MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {size} bytes is too big")
+
+        data = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+
+    if session is not None:
+        data = session.open(data)
+
+    return json.loads(data)
+
+
+###########
+#  Agent  #
+###########
+
+
+# Class for the agent, it runs the commands for the bot as the right user
+# On the unix socket only the uids in allowed_uids can connect, over tcp the client has to know the token
+# The socket belongs to socket_group so a bot that isn't root can open it
+# Only the users in allowed_users can be used
+class Agent():
+    def __init__(self, socket_path:str, allowed_uids:Set[int], allowed_users:Optional[Set[str]]=None, host:str="", port:int=0, token:str="", socket_group:Optional[int]=None) -> None:
+        self.socket_path = socket_path
+        self.socket_group = socket_group
+        self.allowed_uids = allowed_uids
+        self.allowed_users = allowed_users
+        self.host = host
+        self.port = port
+        self.token = token
+
+    async def serve(self) -> None:
+        servers = []
+        if self.socket_path != "":
+            os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+            servers.append(await asyncio.start_unix_server(self.handle_unix_connection, self.socket_path))
+            if self.socket_group is not None:
+                os.chown(self.socket_path, -1, self.socket_group)
+            os.chmod(self.socket_path, 0o660)
+            print(f"Agent listening on {self.socket_path}")
+
+        if self.port != 0:
+            servers.append(await asyncio.start_server(self.handle_tcp_connection, self.host, self.port))
+            print(f"Agent listening on {self.host}:{self.port}")
+
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    # Returns the uid of the process on the other end of the socket
+    def peer_uid(self, writer:asyncio.StreamWriter) -> Optional[int]:
+        sock = writer.get_extra_info("socket")
+        if sock is None:
+            return None
+
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", credentials)[1]
+
+    async def handle_unix_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        if self.peer_uid(writer) not in self.allowed_uids:
+            writer.close()
+            return
+
+        await self.handle_connection(reader, writer, self.peer_user(writer))
+
+    async def handle_tcp_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        try:
+            session = await asyncio.wait_for(self.authenticate(reader, writer), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            session = None
+
+        if session is None:
+            writer.close()
+            return
+
+        await self.handle_connection(reader, writer, session=session)
+
+    # Checks if the client knows the token and proves the agent knows it too
+    # Returns the session for the rest of the connection
+    async def authenticate(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> Optional[Session]:
+        nonce = secrets.token_hex(16)
+        writer.write(encode_frame({"type": "challenge", "nonce": nonce}))
+        await writer.drain()
+
+        message = await read_frame(reader)
+        if message is None or message.get("type") != "auth" or not isinstance(message.get("nonce"), str) or not isinstance(message.get("mac"), str):
+            return None
+
+        if not hmac.compare_digest(message["mac"], sign(self.token, "client", nonce, message["nonce"])):
+            return None
+
+        writer.write(encode_frame({"type": "ready", "mac": sign(self.token, "agent", message["nonce"], nonce)}))
+        await writer.drain()
+
+        return Session(self.token, nonce, message["nonce"], "agent")
+
+    # Returns the name of the user on the other end of the socket
+    def peer_user(self, writer:asyncio.StreamWriter) -> str:
+        try:
+            return pwd.getpwuid(self.peer_uid(writer)).pw_name
+        except (KeyError, TypeError):
+            return ""
+
+    # default_user is used for commands without a user, over tcp there is none
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter, default_user:str="", session:Optional[Session]=None) -> None:
+        connection = Connection(self, writer, default_user, session)
+        try:
+            while True:
+                try:
+                    message = await read_frame(reader, session)
+                except (ValueError, ConnectionError):
+                    break
+                if message is None:
+                    break
+
+                connection.handle(message)
+        finally:
+            # The processes of a connection stop with it
+            await connection.close()
+
+    # Returns the options to start a process as a user
+    def user_options(self, user:str) -> dict:
+        if self.allowed_users is not None and user not in self.allowed_users:
+            raise PermissionError(f"The agent is not allowed to run commands as '{user}'")
+
+        return user_options(user, self.allowed_users is not None and "root" in self.allowed_users)
+
+
+# Class for a connection to the agent, multiple commands can run at the same time
+class Connection():
+    def __init__(self, agent:Agent, writer:asyncio.StreamWriter, default_user:str="", session:Optional[Session]=None) -> None:
+        self.agent = agent
+        self.writer = writer
+        self.default_user = default_user
+        self.session = session
+        self.tasks : Dict[int, asyncio.Task] = {}
+        self.graces : Dict[int, float] = {}
+
+    def send(self, message:dict) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(encode_frame(message, self.session))
+
+    def handle(self, message:dict) -> None:
+        request_id = message.get("id")
+        if message.get("type") == "run" and request_id not in self.tasks:
+            self.tasks[request_id] = asyncio.create_task(self.run(request_id, message))
+        elif message.get("type") == "cancel" and request_id in self.tasks:
+            self.graces[request_id] = message.get("grace", 5)
+            self.tasks[request_id].cancel()
+
+    # Runs a command and sends its output back
+    # Every request gets either an error or an exit response
+    async def run(self, request_id:int, message:dict) -> None:
+        process = None
+        try:
+            try:
+                # Commands without a user run as the user of the bot, like they would without the agent
+                user = message.get("user") or self.default_user
+                if not isinstance(user, str) or user == "":
+                    raise PermissionError("Commands without a user can only run through the agent on the unix socket")
+
+                options = {"cwd": message.get("cwd") or None}
+                options.update(self.agent.user_options(user))
+
+                process = Process(message["argv"], **options)
+                await process.start()
+            except (OSError, KeyError, TypeError) as error:
+                self.send({"type": "error", "id": request_id, "message": str(error), "missing": isinstance(error, FileNotFoundError)})
+                return
+
+            self.send({"type": "started", "id": request_id})
+            try:
+                async for stream, line in process.lines():
+                    self.send({"type": "line", "id": request_id, "stream": stream, "line": line})
+                    await self.writer.drain()
+            except asyncio.CancelledError:
+                await process.kill(self.graces.get(request_id, 5))
+            except ConnectionError:
+                await process.kill()
+
+            self.send({"type": "exit", "id": request_id, "returncode": process.returncode})
+        except asyncio.CancelledError:
+            # Cancelled before the process was running
+            if process is not None and process.process is not None:
+                await process.kill()
+            self.send({"type": "exit", "id": request_id, "returncode": process.returncode if process is not None else None})
+        finally:
+            del self.tasks[request_id]
+            self.graces.pop(request_id, None)
+
+    async def close(self) -> None:
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+        self.writer.close()
+
+
+############
+#  Client  #
+############
+
+
+# Class the bot uses to run commands through an agent, on a unix socket or on another host over tcp
+# All commands share one connection, it's made again when it was lost
+# After a failed attempt the next one waits a bit longer every time, up to max_retry_delay seconds
+class AgentClient():
+    def __init__(self, socket_path:str="", host:str="", port:int=0, token:str="", max_retry_delay:float=30) -> None:
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.token = token
+        self.max_retry_delay = max_retry_delay
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.reader : Optional[asyncio.StreamReader] = None
+        self.writer : Optional[asyncio.StreamWriter] = None
+        self.session : Optional[Session] = None
+        self.responses : Dict[int, asyncio.Queue] = {}
+        self.next_id = 0
+        self.lock = asyncio.Lock()
+        self.task : Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    # Where the agent can be reached, used in errors
+    @property
+    def address(self) -> str:
+        return self.socket_path if self.socket_path != "" else f"{self.host}:{self.port}"
+
+    # Returns the streams and over tcp the session of the new connection
+    async def open_connection(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, Optional[Session]]:
+        if self.socket_path != "":
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            return reader, writer, None
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            session = await asyncio.wait_for(self.authenticate(reader, writer), HANDSHAKE_TIMEOUT)
+        except BaseException:
+            writer.close()
+            raise
+
+        return reader, writer, session
+
+    # Proves the bot knows the token and checks if the agent knows it too
+    async def authenticate(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> Session:
+        message = await read_frame(reader)
+        if message is None or message.get("type") != "challenge" or not isinstance(message.get("nonce"), str):
+            raise ConnectionError("The agent did not send a challenge")
+
+        nonce = secrets.token_hex(16)
+        writer.write(encode_frame({"type": "auth", "nonce": nonce, "mac": sign(self.token, "client", message["nonce"], nonce)}))
+        await writer.drain()
+
+        response = await read_frame(reader)
+        if response is None:
+            raise ConnectionError("The agent refused the token")
+        if response.get("type") != "ready" or not hmac.compare_digest(response.get("mac", ""), sign(self.token, "agent", nonce, message["nonce"])):
+            raise ConnectionError("The agent does not know the token")
+
+        return Session(self.token, message["nonce"], nonce, "client")
+
+    async def connect(self) -> None:
+        async with self.lock:
+            if self.connected:
+                return
+
+            loop = asyncio.get_running_loop()
+            if loop.time() < self.retry_at:
+                raise ConnectionError(f"Could not connect to the agent at {self.address}, trying again in {self.retry_at - loop.time():.0f} seconds")
+
+            try:
+                self.reader, self.writer, self.session = await self.open_connection()
+            except (OSError, ValueError, asyncio.TimeoutError) as error:
+                self.retry_delay = min(max(1, self.retry_delay * 2), self.max_retry_delay)
+                self.retry_at = loop.time() + self.retry_delay
+                reason = error.strerror if isinstance(error, OSError) and error.strerror else str(error) or type(error).__name__
+                raise ConnectionError(f"Could not connect to the agent at {self.address}: {reason}") from error
+
+            self.retry_delay = 0
+            self.task = asyncio.create_task(self.read_responses(self.reader, self.session))
+
+    # Passes every response to the request it belongs to
+    async def read_responses(self, reader:asyncio.StreamReader, session:Optional[Session]) -> None:
+        try:
+            while True:
+                message = await read_frame(reader, session)
+                if message is None:
+                    break
+
+                queue = self.responses.get(message.get("id"))
+                if queue is not None:
+                    queue.put_nowait(message)
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+            self.writer = None
+            for queue in self.responses.values():
+                queue.put_nowait({"type": "error", "message": "The connection to the agent was lost", "missing": False})
+
+    async def send(self, message:dict) -> None:
+        if not self.connected:
+            raise ConnectionError("The connection to the agent was lost")
+
+        self.writer.write(encode_frame(message, self.session))
+        await self.writer.drain()
+
+    # Reserves an id for a request
+    def open_request(self) -> Tuple[int, asyncio.Queue]:
+        self.next_id += 1
+        queue = asyncio.Queue()
+        self.responses[self.next_id] = queue
+
+        return self.next_id, queue
+
+    def close_request(self, request_id:int) -> None:
+        self.responses.pop(request_id, None)
+
+    # Makes a process that runs through the agent
+    def process(self, argv:List[str], cwd:str="", user:str="") -> "AgentProcess":
+        return AgentProcess(self, argv, cwd, user)
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+# Class that spreads the commands for a node over a few connections
+class AgentPool():
+    def __init__(self, host:str, port:int, token:str, size:int=2) -> None:
+        self.host = host
+        self.port = port
+        self.token = token
+        self.clients = [AgentClient(host=host, port=port, token=token) for _ in range(size)]
+        self.turn = 0
+
+    # Makes a process on the connection with the least running commands, taking turns when they're equal
+    def process(self, argv:List[str], cwd:str="", user:str="") -> "AgentProcess":
+        self.turn = (self.turn + 1) % len(self.clients)
+        clients = self.clients[self.turn:] + self.clients[:self.turn]
+        client = min(clients, key=lambda client: len(client.responses))
+        return client.process(argv, cwd, user)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(client.close() for client in self.clients))
+
+
+# Class with the same interface as Process for a command that runs through an agent
+class AgentProcess():
+    def __init__(self, client:AgentClient, argv:List[str], cwd:str, user:str) -> None:
+        self.client = client
+        self.command_array = argv
+        self.cwd = cwd
+        self.user = user
+        self.request_id : Optional[int] = None
+        self.queue : Optional[asyncio.Queue] = None
+        self.returncode : Optional[int] = None
+        self.output : Dict[str, OutputTail] = {"stdout": OutputTail(), "stderr": OutputTail()}
+
+    @property
+    def stdout(self) -> str:
+        return str(self.output["stdout"])
+
+    @property
+    def stderr(self) -> str:
+        return str(self.output["stderr"])
+
+    # Asks the agent to start the command and waits until it has
+    async def start(self) -> None:
+        await self.client.connect()
+        self.request_id, self.queue = self.client.open_request()
+        await self.client.send({"type": "run", "id": self.request_id, "argv": self.command_array, "cwd": self.cwd, "user": self.user})
+
+        message = await self.queue.get()
+        if message["type"] == "error":
+            self.client.close_request(self.request_id)
+            if message.get("missing"):
+                raise FileNotFoundError(message["message"])
+            raise ConnectionError(message["message"])
+
+    async def lines(self) -> AsyncIterator[Tuple[str, str]]:
+        while True:
+            message = await self.queue.get()
+            if message["type"] == "line":
+                stream = "stdout" if message["stream"] == "stdout" else "stderr"
+                self.output[stream].add(message["line"])
+                yield stream, message["line"]
+            elif message["type"] == "exit":
+                self.returncode = message["returncode"]
+                self.client.close_request(self.request_id)
+                return
+            elif message["type"] == "error":
+                self.client.close_request(self.request_id)
+                raise ConnectionError(message["message"])
+
+    # Asks the agent to stop the process group and waits until it has
+    async def kill(self, grace:float=5) -> None:
+        if self.request_id is None or self.request_id not in self.client.responses:
+            return
+
+        try:
+            await self.client.send({"type": "cancel", "id": self.request_id, "grace": grace})
+        except ConnectionError:
+            self.client.close_request(self.request_id)
+            return
+
+        try:
+            await asyncio.wait_for(self.wait_for_exit(), grace + 5)
+        except asyncio.TimeoutError:
+            pass
+        self.client.close_request(self.request_id)
+
+    # Keeps the output that still arrives until the process has stopped
+    async def wait_for_exit(self) -> None:
+        while True:
+            message = await self.queue.get()
+            if message["type"] == "exit":
+                self.returncode = message["returncode"]
+                return
+            if message["type"] == "error":
+                return
+            if message["type"] == "line":
+                self.output["stdout" if message["stream"] == "stdout" else "stderr"].add(message["line"])
+
+
+#####################
+#  Start of script  #
+#####################
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs the commands of Discord-LinuxGSM without su")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the unix socket, empty to only listen on tcp")
+    parser.add_argument("--allow-uid", type=int, action="append", default=[], help="uid that may connect, can be given multiple times (root and the agent's own user always can)")
+    parser.add_argument("--group", default="", help="group of the socket, the user of the bot has to be in it to connect")
+    parser.add_argument("--user", action="append", help="user the commands may run as, can be given multiple times (default: every user except root)")
+    parser.add_argument("--listen", default="", help="host:port to accept connections from bots on other hosts, requires a token")
+    parser.add_argument("--token-file", default="", help="file with the token for --listen, the AGENT_TOKEN environment variable can be used instead")
+    arguments = parser.parse_args()
+
+    allowed_uids = {0, os.getuid(), *arguments.allow_uid}
+    allowed_users = set(arguments.user) if arguments.user else None
+
+    socket_group = None
+    if arguments.group != "":
+        try:
+            socket_group = grp.getgrnam(arguments.group).gr_gid
+        except KeyError:
+            parser.error(f"The group '{arguments.group}' does not exist")
+
+    host, port = "", 0
+    token = os.environ.get("AGENT_TOKEN", "")
+    if arguments.listen != "":
+        host, _, port = arguments.listen.rpartition(":")
+        if not port.isdigit():
+            parser.error("--listen has to be host:port")
+        port = int(port)
+
+        if arguments.token_file != "":
+            with open(arguments.token_file) as file:
+                token = file.read().strip()
+        if len(token) < 16:
+            parser.error("--listen requires a token of at least 16 characters")
+
+    try:
+        asyncio.run(Agent(arguments.socket, allowed_uids, allowed_users, host, port, token, socket_group).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
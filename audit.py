@@ -0,0 +1,153 @@
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import IO, List, Optional
+
+from utils import print_to_console
+
+
+# Class that writes the audit entries as json lines
+# Entries are queued and written in batches in a thread so the event loop never waits for the disk
+# The file gets rotated when it's too big or too old, rotated files get compressed
+class AuditLog():
+    def __init__(self, path:str="./logs/audit.log", max_bytes:int=10 * 1024 * 1024, max_age:int=24 * 60 * 60, flush_interval:float=1, batch_size:int=1000, max_pending:int=100000) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue : "asyncio.Queue[dict]" = asyncio.Queue(max_pending)
+        self.dropped = 0
+        # The entries the writer is collecting and the write that is running in the thread
+        self.batch : List[dict] = []
+        self.writing : Optional[asyncio.Future] = None
+        self.file : Optional[IO[str]] = None
+        self.opened = 0.0
+        self.task : Optional[asyncio.Task] = None
+
+    # Queues an entry, entries are dropped instead of waiting when the writer can't keep up
+    def record(self, entry:dict) -> None:
+        entry["time"] = datetime.now().isoformat(timespec="milliseconds")
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    # Starts writing the queued entries
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    # Stops the writer and writes everything that's left
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+        if self.writing is not None:
+            await self.writing
+
+        batch, self.batch = self.batch, []
+        while not self.queue.empty():
+            batch.extend(self.take_batch())
+        await self.flush(batch)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.close)
+        except OSError as error:
+            print_to_console(f"Could not close the audit log because '{error}'")
+
+    async def run(self) -> None:
+        while True:
+            self.batch.append(await self.queue.get())
+
+            # Waits a bit so multiple entries get written at once
+            await asyncio.sleep(self.flush_interval)
+            self.batch.extend(self.take_batch())
+            batch, self.batch = self.batch, []
+            await self.flush(batch)
+
+    # Takes the entries that are waiting in the queue
+    def take_batch(self) -> List[dict]:
+        batch = []
+        while not self.queue.empty() and len(batch) < self.batch_size:
+            batch.append(self.queue.get_nowait())
+
+        return batch
+
+    async def flush(self, batch:List[dict]) -> None:
+        if self.dropped > 0:
+            batch.append({"time": datetime.now().isoformat(timespec="milliseconds"), "event": "dropped", "count": self.dropped})
+            self.dropped = 0
+
+        if len(batch) == 0:
+            return
+
+        # Stopping the writer doesn't stop a write that already started, stop waits for it instead
+        self.writing = asyncio.get_running_loop().run_in_executor(None, self.write, batch)
+        error = await asyncio.shield(self.writing)
+        # The entries are dropped, the writer keeps running so the next batch can be written once the problem is solved
+        if error is not None:
+            print_to_console(f"Could not write {len(batch)} audit log entries to {self.path} because '{error}'")
+
+    ##########################
+    #  Runs inside a thread  #
+    ##########################
+
+    # Returns the error instead of raising it, the file is opened again for the next batch
+    def write(self, batch:List[dict]) -> Optional[OSError]:
+        try:
+            if self.file is None:
+                self.open()
+            elif self.file.tell() >= self.max_bytes or time.time() - self.opened >= self.max_age:
+                self.rotate()
+
+            self.file.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch))
+            self.file.flush()
+        except OSError as error:
+            try:
+                self.close()
+            except OSError:
+                pass
+            return error
+
+        return None
+
+    def open(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.opened = time.time()
+
+    def close(self) -> None:
+        if self.file is not None:
+            try:
+                self.file.close()
+            finally:
+                self.file = None
+
+    # Moves the current file aside, compresses it and starts a new file
+    def rotate(self) -> None:
+        self.close()
+
+        root, extension = os.path.splitext(self.path)
+        rotated = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{extension}"
+        number = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{number}{extension}"
+            number += 1
+        os.replace(self.path, rotated)
+
+        with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+
+        self.open()
@@ -0,0 +1,165 @@
+import json
+import os
+import stat
+from typing import List
+
+import discord
+
+
+# Template commands used for every synthetic server
+TEMPLATE_COMMANDS = {
+    "start": {"server command": True, "command": "start", "require path": False, "strip user input": False},
+    "stop": {"server command": True, "command": "stop", "require path": False, "strip user input": False},
+    "restart": {"server command": True, "command": "restart", "require path": False, "strip user input": False},
+    "update": {"server command": True, "command": "update", "require path": False, "strip user input": False},
+    "backup": {"server command": True, "command": "backup", "require path": False, "strip user input": False},
+    "details": {"server command": True, "command": "details", "require path": False, "strip user input": False},
+    "postdetails": {"server command": True, "command": "postdetails", "require path": False, "strip user input": False},
+    "change_map": {"server command": True, "command": "send map {}", "require path": False, "strip user input": False},
+    "delete": {"server command": False, "command": "rm {}", "require path": True, "strip user input": True}
+}
+
+
+##################
+#  Config files  #
+##################
+
+
+# Writes a settings.json that passes validation
+def make_settings() -> dict:
+    return {
+        "prefix": "!!",
+        "token": "A" * 24 + "." + "B" * 6 + "." + "C" * 27,
+        "activity type": "watching",
+        "activity text": "benchmarks",
+        "server": 100000000000000000,
+        "head admin": 100000000000000001,
+        "admin": 100000000000000002,
+        "moderator": 100000000000000003,
+        "embed colour": [255, 255, 255]
+    }
+
+# Makes the servers.json data for an amount of servers
+def make_servers(amount:int, script_path:str) -> dict:
+    servers = {}
+    for i in range(amount):
+        commands = {}
+        for name, template in TEMPLATE_COMMANDS.items():
+            commands[name] = {"name": name, "user": f"user{i}", "command": name}
+            if template["require path"]:
+                commands[name]["path"] = "./serverfiles/"
+
+        servers[f"server{i}"] = {
+            "name": f"server{i}",
+            "path": script_path,
+            "head admin": ["delete", "update", "backup"],
+            "admin": ["start", "stop", "restart", "change_map"],
+            "moderator": ["details", "postdetails"],
+            "commands": commands
+        }
+
+    return servers
+
+# Makes a directory with a full config for an amount of servers
+def make_config(directory:str, amount:int) -> None:
+    os.makedirs(os.path.join(directory, "configs"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "serverfiles"), exist_ok=True)
+
+    # One shared executable is enough to pass the path checks
+    script_path = os.path.join(directory, "gameserver")
+    with open(script_path, "w") as file:
+        file.write("#!/bin/sh\n")
+    os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IXUSR)
+
+    files = {
+        "settings.json": make_settings(),
+        "commands.json": TEMPLATE_COMMANDS,
+        "servers.json": make_servers(amount, script_path)
+    }
+    for name, data in files.items():
+        with open(os.path.join(directory, "configs", name), "w") as file:
+            json.dump(data, file, indent=4)
+
+
+##################
+#  Fake Discord  #
+##################
+
+
+# Stand-ins for the discord.py objects the cog touches
+class FakeRole():
+    def __init__(self, id:int) -> None:
+        self.id = id
+
+
+class FakePermissions():
+    def __init__(self, administrator:bool=False) -> None:
+        self.administrator = administrator
+        self.send_messages = True
+        self.manage_messages = True
+
+
+class FakeMessage():
+    def __init__(self, channel:"FakeChannel", embed:discord.Embed=None) -> None:
+        self.id = id(self)
+        self.channel = channel
+        self.embeds = [embed] if embed is not None else []
+        self.reactions : List[str] = []
+        self.jump_url = ""
+
+    async def add_reaction(self, emoji:str) -> None:
+        self.reactions.append(emoji)
+
+    async def clear_reactions(self) -> None:
+        self.reactions.clear()
+
+    async def edit(self, embed:discord.Embed=None) -> None:
+        self.embeds = [embed]
+
+
+class FakeChannel():
+    def __init__(self, guild:"FakeGuild") -> None:
+        self.id = 1
+        self.guild = guild
+        self.name = "benchmarks"
+        self.mention = "#benchmarks"
+        self.sent : List[FakeMessage] = []
+
+    def permissions_for(self, member:"FakeMember") -> FakePermissions:
+        return FakePermissions()
+
+    async def send(self, content:str=None, embed:discord.Embed=None, delete_after:int=None) -> FakeMessage:
+        msg = FakeMessage(self, embed)
+        self.sent.append(msg)
+        return msg
+
+
+class FakeMember():
+    def __init__(self, roles:List[FakeRole], administrator:bool=False) -> None:
+        self.id = 2
+        self.bot = False
+        self.roles = roles
+        self.guild_permissions = FakePermissions(administrator)
+        self.mention = "@benchmark"
+
+
+class FakeGuild():
+    def __init__(self) -> None:
+        self.id = 100000000000000000
+        self.me = FakeMember([])
+        self.filesize_limit = 8 * 1024 * 1024
+
+
+class FakeContext():
+    def __init__(self, author:FakeMember, channel:FakeChannel) -> None:
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+
+
+class FakeIncomingMessage():
+    def __init__(self, author:FakeMember, channel:FakeChannel, content:str) -> None:
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
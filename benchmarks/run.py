@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Awaitable, Callable, List
+
+# Makes the bot modules importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+
+from audit import AuditLog
+from benchmarks.fixtures import FakeChannel, FakeContext, FakeGuild, FakeIncomingMessage, FakeMember, FakeRole, make_config
+from cache import ResultCache
+from cogs.commands import Commands
+from config_parser import config_hash, load_snapshot, parse_commands, parse_servers, parse_settings, save_snapshot, server_path_checks
+from flight import SingleFlight
+from metrics import Metrics
+from query import StatusPoller
+from scheduler import Scheduler
+from timing import StageStats
+from utils import read_file
+
+
+###########
+#  utils  #
+###########
+
+
+# Summarises a list of timings in seconds
+def summarise(timings:List[float]) -> dict:
+    return {
+        "repeat": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings)
+    }
+
+# Times a function
+def measure(function:Callable[[], None], repeat:int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return summarise(timings)
+
+# Times a coroutine function
+async def measure_async(function:Callable[[], Awaitable[None]], repeat:int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await function()
+        timings.append(time.perf_counter() - start)
+
+    return summarise(timings)
+
+
+################
+#  Benchmarks  #
+################
+
+
+# Times parsing the three config files and loading them from the snapshot
+def bench_parsing(repeat:int) -> dict:
+    results = {}
+    commands_data = parse_commands()
+
+    results["parse_settings"] = measure(parse_settings, repeat)
+    results["parse_commands"] = measure(parse_commands, repeat)
+    results["parse_servers"] = measure(lambda: parse_servers(commands_data), repeat)
+
+    content_hash = config_hash()
+    servers_data = read_file("./configs/servers.json")
+    path_checks = server_path_checks(servers_data, commands_data)
+    save_snapshot(content_hash, commands_data, parse_servers(commands_data, servers_data, path_checks), path_checks)
+    results["load_snapshot"] = measure(lambda: load_snapshot(content_hash), repeat)
+
+    return results
+
+# Times resolving the commands every role can use on every server
+def bench_permissions(servers:list, repeat:int) -> dict:
+    def resolve() -> None:
+        for server in servers:
+            server.head_admin
+            server.admin
+            server.moderator
+
+    return {"server_permissions": measure(resolve, repeat)}
+
+# Times the servers overview and opening a menu with a fake Discord context
+async def bench_cog(servers:list, repeat:int, menus:int) -> dict:
+    results = {}
+
+    head_admin = FakeRole(1)
+    bot = SimpleNamespace(
+        prefix="!!",
+        head_admin=head_admin,
+        admin=FakeRole(2),
+        moderator=FakeRole(3),
+        embed_colour=discord.Color.from_rgb(255, 255, 255),
+        servers=servers,
+        scheduler=Scheduler(4),
+        result_cache=ResultCache(),
+        audit_log=AuditLog(),
+        metrics=Metrics(),
+        stage_stats=StageStats(),
+        debug_timings=False,
+        agent=None,
+        nodes={},
+        single_flight=SingleFlight(),
+        status_poller=StatusPoller(0)
+    )
+    cog = Commands(bot)
+    guild = FakeGuild()
+    channel = FakeChannel(guild)
+    member = FakeMember([head_admin])
+    ctx = FakeContext(member, channel)
+
+    results["servers_overview"] = await measure_async(lambda: cog._servers.callback(cog, ctx), repeat)
+
+    # Opens one menu for each of the first servers, the menu gets closed right after so the next one can open
+    async def open_menus() -> None:
+        for server in servers[:menus]:
+            await cog.process_command(FakeIncomingMessage(member, channel, server.name), server)
+            cog.remove_message(cog.menus.for_server(server.name).message_id)
+        channel.sent.clear()
+
+    results["process_command"] = await measure_async(open_menus, repeat)
+    results["process_command"]["menus"] = min(menus, len(servers))
+
+    return results
+
+# Runs every benchmark for an amount of servers
+def bench_size(amount:int, repeat:int, menus:int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        make_config(directory, amount)
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            # The parsers print their warnings, which would end up in the json output
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = bench_parsing(repeat)
+                servers = parse_servers(parse_commands())
+                results.update(bench_permissions(servers, repeat))
+                results.update(asyncio.run(bench_cog(servers, repeat, menus)))
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+#####################
+#  Start of script  #
+#####################
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks config parsing, permission resolution and menu rendering")
+    parser.add_argument("--sizes", default="10,1000,10000", help="comma separated amounts of servers")
+    parser.add_argument("--repeat", type=int, default=5, help="how many times every benchmark runs")
+    parser.add_argument("--menus", type=int, default=1000, help="how many menus are opened per process_command run")
+    parser.add_argument("--output", help="file to write the json results to, defaults to stdout")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {}
+    }
+    for size in args.sizes.split(","):
+        report["results"][size] = bench_size(int(size), args.repeat, args.menus)
+
+    if args.output is None:
+        print(json.dumps(report, indent=4))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
@@ -0,0 +1,41 @@
+import asyncio
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from command import CommandResult
+
+
+# Class that keeps the results of read only commands for a while
+# The oldest results are dropped once there are more than max_size
+class ResultCache():
+    def __init__(self, max_size:int=1024) -> None:
+        self.max_size = max_size
+        self.results : "OrderedDict[Hashable, Tuple[float, CommandResult]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    # Returns a result if it's younger than ttl seconds, the age is set on the result
+    def get(self, key:Hashable, ttl:float) -> Optional[CommandResult]:
+        cached = self.results.get(key)
+        if cached is None:
+            return None
+
+        age = asyncio.get_running_loop().time() - cached[0]
+        if age > ttl:
+            del self.results[key]
+            return None
+
+        return cached[1]._replace(cache_age=age)
+
+    # Saves a result
+    def put(self, key:Hashable, result:CommandResult) -> None:
+        self.results[key] = (asyncio.get_running_loop().time(), result)
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    # Removes every result of a server
+    def clear_server(self, server:str) -> None:
+        for key in [key for key in self.results if key[0] == server]:
+            del self.results[key]
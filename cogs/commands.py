@@ -1,13 +1,17 @@
 import asyncio
-import os
+import time
 from datetime import datetime
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Union
 
 import discord
 from discord.ext import commands
-from server import Server
-from utils import get_unix_time, send
-from command import Command
+from output import GroupOutput, LiveOutput, OutputBuffer
+from server import ADMIN, HEAD_ADMIN, MODERATOR, NO_ROLE, Server
+from timers import TimerHeap
+from timing import STAGES, StageTimer
+from utils import print_to_console, send
+from command import Command, CommandResult
+from menu import Menu, MenuRegistry, ReactionAdder
 
 
 # Class for all the server commands
@@ -16,8 +20,14 @@ class Commands(commands.Cog):
     def __init__(self, bot:commands.Bot) -> None:
         self.bot : commands.Bot = bot
         self.servers : Dict[str, Server] = self.make_servers_variable()
-        self.messages : Dict[discord.Message, Tuple[ReactionDeleter, Command]] = {}
+        self.menus : MenuRegistry = MenuRegistry()
+        self.menu_timeout : int = 30
         self.emoji : List[str] = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣"]
+        self.page_emoji : List[str] = ["◀️", "▶️"]
+        self.cancel_emoji : str = "⏹️"
+        # Message id of a running command with its cancel event
+        self.running : Dict[int, Tuple[asyncio.Event, Server, Command]] = {}
+        self.timers : TimerHeap = TimerHeap()
 
     # Makes the self.servers variable
     def make_servers_variable(self) -> dict:
@@ -35,7 +45,7 @@ class Commands(commands.Cog):
 
     # Cog check 
     def cog_check(self, ctx:commands.Context) -> bool:        
-        return self.bot.head_admin in ctx.author.roles or self.bot.admin in ctx.author.roles or self.moderator in ctx.author.roles or ctx.author.guild_permissions.administrator
+        return self.get_role(ctx.author) != NO_ROLE
 
 
     ###############
@@ -43,39 +53,100 @@ class Commands(commands.Cog):
     ###############
 
 
-    # Generic function to write content to a file
-    def write_to_file(self, location:str, content:str) -> bool:
+    # Returns the highest staff role of a member
+    def get_role(self, member:discord.Member) -> int:
+        if self.bot.head_admin in member.roles or member.guild_permissions.administrator:
+            return HEAD_ADMIN
+        if self.bot.admin in member.roles:
+            return ADMIN
+        if self.bot.moderator in member.roles:
+            return MODERATOR
+
+        return NO_ROLE
+
+    # Returns a message of a menu without needing the message cache
+    def get_message(self, menu:Menu) -> Optional[discord.PartialMessage]:
+        channel = self.bot.get_channel(menu.channel_id)
+        if channel is None:
+            return None
+
+        return channel.get_partial_message(menu.message_id)
+
+    # Registers a new menu and starts its timeout
+    def open_menu(self, message:discord.Message, server:Server, commands:Tuple[Command, ...]) -> Menu:
+        menu = Menu(message.id, message.channel.id, server.name, commands)
+        self.menus.add(menu)
+        self.extend_menu(menu)
+
+        return menu
+
+    # Resets the timeout of a menu
+    def extend_menu(self, menu:Menu) -> None:
+        self.timers.schedule(menu.message_id, self.menu_timeout, lambda: self.close_menu(menu.message_id))
+
+    # Removes a menu without touching the message
+    def remove_message(self, message_id:int) -> Optional[Menu]:
+        self.timers.cancel(message_id)
+        menu = self.menus.remove(message_id)
+        if menu is not None and menu.reaction_adder is not None:
+            menu.reaction_adder.cancel()
+
+        return menu
+
+    # Removes a menu and starts the task to delete all its reactions
+    def close_menu(self, message_id:int) -> None:
+        menu = self.remove_message(message_id)
+        if menu is not None:
+            asyncio.create_task(self.remove_reactions(menu))
+
+    # Removes all reactions of a menu
+    async def remove_reactions(self, menu:Menu) -> None:
+        message = self.get_message(menu)
+        if message is None:
+            return
+
+        await self.clear_reactions(message)
+
+    # Removes all reactions of a message
+    async def clear_reactions(self, message:Union[discord.Message, discord.PartialMessage]) -> None:
         try:
-            with open(location, "w") as file:
-                file.write(content)
-        except:
-            return False
+            await message.clear_reactions()
+        except (discord.errors.Forbidden, discord.errors.NotFound):
+            return
 
-        return True
+    # Replaces the reactions of a menu with the cancel reaction
+    async def add_cancel_reaction(self, menu:Menu, message:Union[discord.Message, discord.PartialMessage]) -> None:
+        await self.remove_reactions(menu)
+        if message.id not in self.running:
+            return
 
-    # Generic function to delete a file
-    def delete_file(self, file_location:str) -> bool:
-        if os.path.exists(file_location):
-            try:
-                os.remove(file_location)
-                return True
-            except:
-                return False
-        return False
-
-    # Removes a message from self.messages
-    def remove_message(self, message:discord.Message) -> bool:
         try:
-            del self.messages[message]
-        except KeyError:
-            return False
+            await message.add_reaction(self.cancel_emoji)
+        except (discord.errors.Forbidden, discord.errors.NotFound):
+            return
+
+    # Cancels a running command if the member is allowed to use it
+    def cancel_command(self, message_id:int, member:discord.Member) -> None:
+        cancel, server, command = self.running[message_id]
+        if server.can_use(command, self.get_role(member)):
+            cancel.set()
+
+    # Returns the cached status of a game server for the servers overview
+    def render_status(self, server:Server) -> str:
+        status = self.bot.status_poller.get(server)
+        if status is None:
+            return ""
+
+        if not status.online:
+            return " ▫️ 🔴 Offline"
 
-        return True
+        return f" ▫️ 🟢 `{status.players}/{status.max_players}` on `{status.map}` ▫️ `{round(status.latency * 1000)} ms`"
 
     # Generic function to send code blocks
     async def send_message(self, channel:discord.TextChannel, content:str, delete_after:int=None) -> Optional[discord.Message]:
         try:
-            msg = await channel.send(content, delete_after=delete_after)
+            with self.bot.metrics.discord_call("send_message"):
+                msg = await channel.send(content, delete_after=delete_after)
         except discord.errors.Forbidden:
             info = await self.bot.application_info()
             owner = info.owner
@@ -89,35 +160,61 @@ class Commands(commands.Cog):
         return msg
 
     # Generic function to send files
-    async def send_file(self, channel:discord.TextChannel, file_location:str, filename:str=None, delete_after:int=None) -> Optional[discord.Message]:
-        try:
-            msg = await channel.send(file=discord.File(file_location, filename=filename if filename is not None else ""), delete_after=delete_after)
-        except discord.errors.Forbidden:
-            info = await self.bot.application_info()
-            owner = info.owner
+    # Every file gets its own message as the upload limit of Discord is for the whole message
+    async def send_files(self, channel:discord.TextChannel, files:List[discord.File], delete_after:int=None) -> Optional[discord.Message]:
+        msg = None
+        for file in files:
             try:
-                await owner.send(f"""I am unable to send messages in {channel.name}.
-                                    Without the proper permissions I'm unable to function properly!""")
+                with self.bot.metrics.discord_call("send_files"):
+                    msg = await channel.send(file=file, delete_after=delete_after)
             except discord.errors.Forbidden:
-                pass
-            return None
-        
+                info = await self.bot.application_info()
+                owner = info.owner
+                try:
+                    await owner.send(f"""I am unable to send messages in {channel.name}.
+                                        Without the proper permissions I'm unable to function properly!""")
+                except discord.errors.Forbidden:
+                    pass
+                return None
+            except discord.errors.HTTPException as error:
+                print_to_console(f"Could not upload {file.filename} because '{error}'")
+                return None
+
         return msg
 
+    # Sends command output as a code block or as attachments if it's too long
+    # streamed is the output that was written into a buffer while the command ran
+    # Both are the end of the same output, so the longest one is sent
+    async def send_output(self, channel:discord.TextChannel, name:str, content:Optional[str], streamed:Optional[OutputBuffer]=None) -> None:
+        if content is None:
+            content = ""
+
+        if streamed is None or streamed.size <= len(content):
+            if content == "":
+                return
+
+            # Discord allows 2000 characters in a message
+            message = f"{name}:\n```bash\n{content}```"
+            if len(message) <= 2000:
+                await self.send_message(channel, message, delete_after=300)
+                return
+
+            streamed = OutputBuffer(name)
+            streamed.write(content)
+
+        # Leaves some room for the rest of the request
+        await self.send_files(channel, streamed.files(channel.guild.filesize_limit - 64 * 1024), delete_after=300)
+
     # Checks if everything is in order
     async def process_command(self, message:discord.Message, server:Server) -> None:
         # Limits to one concurrent menu / server
-        for msg in self.messages:
-            if msg.embeds[0].title == message.content:
-                await send(self.bot, msg.channel, description=f"There already is a [menu]({msg.jump_url}) open to execute a command for that server!")
-                return
+        menu = self.menus.for_server(server.name)
+        if menu is not None:
+            jump_url = f"https://discord.com/channels/{message.guild.id}/{menu.channel_id}/{menu.message_id}"
+            await send(self.bot, message.channel, description=f"There already is a [menu]({jump_url}) open to execute a command for that server!")
+            return
 
-        if self.bot.head_admin in message.author.roles or message.author.guild_permissions.administrator:
-            commands = server.head_admin
-        elif self.bot.admin in message.author.roles:
-            commands = server.admin
-        else:
-            commands = server.moderator
+        commands = server.commands_for(self.get_role(message.author))
 
         # Checks if the bot has the right permissions
         perms = message.channel.permissions_for(message.guild.me)
@@ -126,48 +223,131 @@ class Commands(commands.Cog):
                                                             I require the `manage messages` and `send messages` permissions to function properly""")
             return
 
-        if commands == []:
+        if len(commands) == 0:
             return
 
+        description, footer = self.render_page(commands, 0)
+        msg = await send(self.bot, message.channel, description, title=message.content, footer=footer)
+        if msg is None:
+            return
+
+        # The menu can be used as soon as the first reaction is there
+        menu = self.open_menu(msg, server, commands)
+        menu.reaction_adder = ReactionAdder(msg, self.page_reactions(commands, 0))
+        menu.reaction_adder.start()
+
+    # Returns the amount of pages a menu needs
+    def page_count(self, commands:Tuple[Command, ...]) -> int:
+        return max((len(commands) + len(self.emoji) - 1) // len(self.emoji), 1)
+
+    # Returns the commands on a page
+    def page_commands(self, commands:Tuple[Command, ...], page:int) -> Tuple[Command, ...]:
+        return commands[page * len(self.emoji):(page + 1) * len(self.emoji)]
+
+    # Makes the description and footer for a page of a menu
+    def render_page(self, commands:Tuple[Command, ...], page:int) -> Tuple[str, str]:
         description = ""
-        for i in range(0, len(commands)):
-            description += f"`{i + 1}.` {commands[i].name}\n"
+        for i, command in enumerate(self.page_commands(commands, page)):
+            description += f"`{i + 1}.` {command.name}\n"
+
+        pages = self.page_count(commands)
+        footer = f"Page {page + 1}/{pages}" if pages > 1 else ""
+
+        return description, footer
 
-        msg = await send(self.bot, message.channel, description, title=message.content)
-        for i in range(0, len(commands)):
-            await msg.add_reaction(self.emoji[i])
+    # Returns the reactions a page needs
+    # The page buttons come first so switching pages only adds or removes reactions at the end
+    def page_reactions(self, commands:Tuple[Command, ...], page:int) -> List[str]:
+        reactions = self.page_emoji.copy() if self.page_count(commands) > 1 else []
+        reactions.extend(self.emoji[:len(self.page_commands(commands, page))])
 
-        reaction_deleter = ReactionDeleter(self, msg, 30)
-        self.messages[msg] = [reaction_deleter, commands]
+        return reactions
 
-    # handles reactions being added if it's to go to a different page
-    # TODO
-    async def handle_pages(self) -> None:
-        pass
+    # Handles reactions being added if it's to go to a different page
+    async def handle_pages(self, message:Union[discord.Message, discord.PartialMessage], emoji:str, member:discord.Member) -> None:
+        menu = self.menus.get(message.id)
+        if menu is None:
+            return
+
+        if self.get_role(member) == NO_ROLE:
+            return
+
+        page = menu.page
+        if emoji == self.page_emoji[0]:
+            menu.page = (page - 1) % self.page_count(menu.commands)
+        else:
+            menu.page = (page + 1) % self.page_count(menu.commands)
+        self.extend_menu(menu)
+
+        # Reactions for the old page that are still being added aren't needed anymore
+        present = []
+        if menu.reaction_adder is not None:
+            menu.reaction_adder.cancel()
+            present = menu.reaction_adder.present
+
+        try:
+            await message.remove_reaction(emoji, member)
+        except (discord.errors.Forbidden, discord.errors.NotFound):
+            pass
+
+        description, footer = self.render_page(menu.commands, menu.page)
+        embed = discord.Embed(
+            title=menu.server,
+            description=description,
+            colour=self.bot.embed_colour
+        )
+        embed.set_footer(text=footer)
+        await message.edit(embed=embed)
+
+        # Only the number reactions at the end differ between pages
+        new_reactions = self.page_reactions(menu.commands, menu.page)
+        for emoji in present:
+            if emoji not in new_reactions:
+                try:
+                    await message.clear_reaction(emoji)
+                except (discord.errors.Forbidden, discord.errors.NotFound):
+                    pass
+
+        present = [emoji for emoji in present if emoji in new_reactions]
+        menu.reaction_adder = ReactionAdder(message, [emoji for emoji in new_reactions if emoji not in present], present)
+        menu.reaction_adder.start()
 
     # Handles reactions being added
-    async def handle_reactions(self, reaction:discord.Reaction, member:discord.Member) -> None:
+    async def handle_reactions(self, message:Union[discord.Message, discord.PartialMessage], emoji:str, member:discord.Member) -> None:
+        if emoji in self.page_emoji:
+            await self.handle_pages(message, emoji, member)
+            return
+
         # Get reaction index
         try:
-            index = self.emoji.index(reaction.emoji)
+            index = self.emoji.index(emoji)
         except ValueError:
             return
 
-        # Get command and the server object
+        # Get the menu and the server object
+        timer = StageTimer()
+        permission_start = time.perf_counter()
+        menu = self.menus.get(message.id)
+        if menu is None:
+            return
+
         try:
-            command = self.messages[reaction.message][1][index]
-            server_object = self.servers[reaction.message.embeds[0].title]
+            server_object = self.servers[menu.server]
         except KeyError:
             return
 
+        page_commands = self.page_commands(menu.commands, menu.page)
+        if index >= len(page_commands):
+            return
+        command = page_commands[index]
+
         # Checks if the member has access to the command
-        if not self.bot.head_admin in member.roles or not member.guild_permissions.administrator:
-            if command in server_object.admin and self.bot.admin not in member.roles:
-                if self.bot.moderator not in member.roles:
-                    return
+        if not server_object.can_use(command, self.get_role(member)):
+            return
+        timer.add("permission", time.perf_counter() - permission_start)
 
         # Construct embed
-        self.messages[reaction.message][0].delete_now()
+        self.remove_message(message.id)
         description = f"""{member.mention} used `{command.name}`\n\n
                         Executing the command..."""
         starttime = datetime.now()
@@ -178,18 +358,53 @@ class Commands(commands.Cog):
         )
         embed.set_footer(text=f"Start: {starttime.strftime('%H:%M:%S')}")
 
-        await reaction.message.edit(embed=embed)
+        with timer.stage("embed edit"):
+            await message.edit(embed=embed)
 
-        result = await server_object.execute_command(self.bot, command, reaction.message.channel, member)
+        # The command can be stopped with the cancel reaction
+        cancel = asyncio.Event()
+        self.running[message.id] = (cancel, server_object, command)
+        cancel_reaction = asyncio.create_task(self.add_cancel_reaction(menu, message))
+
+        # Shows the queue position while the command waits for a free slot
+        async def on_queued(position:int) -> None:
+            if position == 0:
+                embed.description = description
+            else:
+                embed.description = f"""{member.mention} used `{command.name}`\n\n
+                        Waiting in the queue... Position `{position}`"""
+            await message.edit(embed=embed)
 
-        if result[0]:
+        live_output = LiveOutput(message, embed, description)
+        # The output goes into the attachments while it arrives
+        streamed = {"stdout": OutputBuffer("Output"), "stderr": OutputBuffer("Errors")}
+
+        def on_line(stream:str, line:str) -> None:
+            streamed[stream].write(line)
+            live_output.add_line(stream, line)
+
+        try:
+            result = await server_object.execute_command(self.bot, command, message.channel, member, on_queued, on_line, timer, cancel)
+        finally:
+            await live_output.stop()
+            del self.running[message.id]
+            cancel_reaction.cancel()
+            asyncio.create_task(self.clear_reactions(message))
+
+        if result.ok:
             description = f"""{member.mention} used `{command.name}`\n
                         ✅ Succesfully executed the command"""
-        elif len(result) >= 4 and result[3]:
+        elif result.stopped == "cancelled":
+            description = f"""{member.mention} used `{command.name}`\n
+                        ⏹️ The command was cancelled"""
+        elif result.stopped == "timed out":
+            description = f"""{member.mention} used `{command.name}`\n
+                        ⏱️ The command was stopped after `{command.timeout}` seconds"""
+        elif result.missing_input:
             description = f"""{member.mention} used `{command.name}`\n
                         ❌ Failed to execute the command
                         {command.name} requires input"""
-        elif not result[0] and result[1] is None and result[2] is None:
+        elif result.stdout is None and result.stderr is None:
             description = f"""{member.mention} used `{command.name}`\n
                         ❌ Could not find the command
                         Please try refreshing your serverlist with `{self.bot.prefix}refresh`"""
@@ -202,31 +417,25 @@ class Commands(commands.Cog):
         duration = endtime - starttime
 
         # Don't show the duration if it takes less than 5 seconds
+        footer = f"Start: {starttime.strftime('%H:%M:%S')} ▫️ End: {endtime.strftime('%H:%M:%S')}"
         if duration.seconds >= 5:
-            embed.set_footer(text=f"Start: {starttime.strftime('%H:%M:%S')} ▫️ End: {endtime.strftime('%H:%M:%S')} ▫️ Duration: {str(duration).split('.')[0]}")
-        else:
-            embed.set_footer(text=f"Start: {starttime.strftime('%H:%M:%S')} ▫️ End: {endtime.strftime('%H:%M:%S')}")
+            footer += f" ▫️ Duration: {str(duration).split('.')[0]}"
+        if result.cache_age is not None:
+            footer += f" ▫️ Cached {int(result.cache_age)}s ago"
+        # The result edit and upload happen after this, they are only in the log and the summary
+        if self.bot.debug_timings:
+            footer += f"\n{timer.render()}"
+        embed.set_footer(text=footer)
 
-        await reaction.message.edit(embed=embed)
+        with timer.stage("result edit"):
+            await message.edit(embed=embed)
 
-        if result[1] is not None and result[1] != "":
-            if len(result[1]) < 3800:
-                await self.send_message(reaction.message.channel, f"Output:\n```bash\n{result[1]}```", delete_after=300)
-            else:
-                file_location = f"./tmp/{str(reaction.message.id)}"
-                file = self.write_to_file(file_location, result[2])
-                if file:
-                    await self.send_file(reaction.message.channel, file_location, "Output", delete_after=300)
-                    self.delete_file(file_location)
-        if result[2] is not None and result[2] != "":
-            if len(result[2]) < 3800:
-                await self.send_message(reaction.message.channel, f"Errors:\n```bash\n{result[2]}```", delete_after=300)
-            else:
-                file_location = f"./tmp/{str(reaction.message.id)}"
-                file = self.write_to_file(f"./tmp/{str(reaction.message.id)}", result[2])
-                if file:
-                    await self.send_file(reaction.message.channel, file_location, "Errors", delete_after=300)
-                    self.delete_file(file_location)
+        with timer.stage("upload"):
+            await self.send_output(message.channel, "Output", result.stdout, streamed["stdout"])
+            await self.send_output(message.channel, "Errors", result.stderr, streamed["stderr"])
+
+        self.bot.stage_stats.record(timer)
+        self.bot.audit_log.record({"event": "timings", "server": server_object.name, "command": command.name, "stages": timer.milliseconds()})
 
 
     ##############
@@ -237,29 +446,15 @@ class Commands(commands.Cog):
     # Command to give an overview of all the available servers for their role
     @commands.command(name="servers")
     async def _servers(self, ctx:commands.Context) -> None:
-        head_admin = False
-        admin = False
-        moderator = False
-
-        # Check the role of the user
-        if self.bot.head_admin in ctx.author.roles or ctx.author.guild_permissions.administrator:
-            head_admin = True
-        elif self.bot.admin in ctx.author.roles:
-            admin = True
-        else:
-            moderator = True
+        role = self.get_role(ctx.author)
 
         description = ""
         i = 1
 
         # Adds server to description if the user has access to any of it's commands
         for server in self.bot.servers:
-            if head_admin and server.head_admin != []:
-                description += f"`{i}.` {server.name}\n"
-            elif admin and server.admin != []:
-                description += f"`{i}.` {server.name}\n"
-            elif moderator and server.moderator != []:
-                description += f"`{i}.` {server.name}\n"
+            if len(server.commands_for(role)) != 0:
+                description += f"`{i}.` {server.name}{self.render_status(server)}\n"
             i += 1
 
         if description == "" or len(self.bot.servers) == 0:
@@ -270,6 +465,107 @@ class Commands(commands.Cog):
         else:
             await send(self.bot, ctx.channel, description)
 
+    # Runs a command from commands.json on every server of a category
+    @commands.command(name="group")
+    async def _group(self, ctx:commands.Context, category:str=None, template:str=None) -> None:
+        role = self.get_role(ctx.author)
+
+        # Without a category and command it shows the categories
+        if category is None or template is None:
+            categories : Dict[str, int] = {}
+            for server in self.bot.servers:
+                if server.category is not None and len(server.commands_for(role)) != 0:
+                    categories[server.category] = categories.get(server.category, 0) + 1
+
+            if len(categories) == 0:
+                await send(self.bot, ctx.channel, "You don't have access to any categories")
+            else:
+                description = f"Use `{self.bot.prefix}group <category> <command>` to run a command on every server of a category\n\n"
+                description += "".join(f"`{name}` ▫️ `{amount}` server(s)\n" for name, amount in categories.items())
+                await send(self.bot, ctx.channel, description)
+            return
+
+        targets : List[Tuple[Server, Command]] = []
+        for server in self.bot.servers:
+            if server.category != category:
+                continue
+            command = server.command_for_template(template, role)
+            if command is not None:
+                targets.append((server, command))
+
+        if len(targets) == 0:
+            await send(self.bot, ctx.channel, f"There are no servers in `{category}` where you can use `{template}`")
+            return
+
+        # The arguments are asked once and used for every server
+        input_result = await targets[0][1].get_arguments(self.bot, ctx.channel, ctx.author)
+        if not input_result[0]:
+            await send(self.bot, ctx.channel, f"`{template}` requires input")
+            return
+
+        header = f"{ctx.author.mention} used `{template}` on `{len(targets)}` server(s)\n"
+        starttime = datetime.now()
+        message = await send(self.bot, ctx.channel, header, title=category, footer=f"Start: {starttime.strftime('%H:%M:%S')}")
+        if message is None:
+            return
+        embed = message.embeds[0]
+        group_output = GroupOutput(message, embed, header, [server.name for server, _ in targets])
+
+        # At most as many servers as there are slots wait in the queue so other commands can still go in between
+        semaphore = asyncio.Semaphore(self.bot.max_jobs)
+
+        async def run(server:Server, command:Command) -> CommandResult:
+            async def on_queued(position:int) -> None:
+                group_output.set_status(server.name, "🔄 Running" if position == 0 else f"⏳ Queue position `{position}`")
+
+            async with semaphore:
+                group_output.set_status(server.name, "🔄 Running")
+                result = await server.run_command(self.bot, command, input_result[1], ctx.author, on_queued)
+
+            if result.cache_age is not None:
+                group_output.set_status(server.name, f"✅ Cached {int(result.cache_age)}s ago")
+            elif result.ok:
+                group_output.set_status(server.name, "✅ Done")
+            elif result.stopped == "timed out":
+                group_output.set_status(server.name, f"⏱️ Stopped after `{command.timeout}` seconds")
+            elif result.returncode is not None:
+                group_output.set_status(server.name, f"❌ Failed with exit code `{result.returncode}`")
+            else:
+                group_output.set_status(server.name, "❌ Failed")
+
+            return result
+
+        try:
+            results = await asyncio.gather(*(run(server, command) for server, command in targets))
+        finally:
+            await group_output.stop()
+
+        endtime = datetime.now()
+        succeeded = len([result for result in results if result.ok])
+        embed.set_footer(text=f"Start: {starttime.strftime('%H:%M:%S')} ▫️ End: {endtime.strftime('%H:%M:%S')} ▫️ Duration: {str(endtime - starttime).split('.')[0]} ▫️ {succeeded}/{len(results)} succeeded")
+        await group_output.update()
+
+        # The output of every server goes in one message or file
+        output = ""
+        for (server, _), result in zip(targets, results):
+            if result.stdout or result.stderr:
+                output += f"===== {server.name} =====\n{result.stdout or ''}{result.stderr or ''}\n"
+        await self.send_output(ctx.channel, "Output", output)
+
+    # Shows how long every stage of the recent commands took
+    @commands.command(name="timings")
+    async def _timings(self, ctx:commands.Context) -> None:
+        description = ""
+        for stage in STAGES:
+            count, p50, p95, p99 = self.bot.stage_stats.summary(stage)
+            if count != 0:
+                description += f"`{stage}` ▫️ p50 `{p50 * 1000:.0f}ms` ▫️ p95 `{p95 * 1000:.0f}ms` ▫️ p99 `{p99 * 1000:.0f}ms` ▫️ `{count}` sample(s)\n"
+
+        if description == "":
+            await send(self.bot, ctx.channel, "No commands have been executed yet")
+        else:
+            await send(self.bot, ctx.channel, description, title="Timings")
+
 
     ###############
     #  Listeners  #
@@ -292,73 +588,50 @@ class Commands(commands.Cog):
             message.content = message.content.replace(self.bot.prefix, "")
             await self.process_command(message, self.servers[message.content])
 
-    # Deletes the message data if the message gets deleted
+    # Deletes the menu if the message gets deleted
+    # The raw events fire for every message, not only for the ones in the message cache
     @commands.Cog.listener()
-    async def on_message_delete(self, message):
-        if message in self.messages.keys():
-            try:
-                del self.messages[message]
-            except KeyError:
-                return
+    async def on_raw_message_delete(self, payload:discord.RawMessageDeleteEvent) -> None:
+        self.remove_message(payload.message_id)
 
     # If an user deletes a reaction the reactions get removed
     @commands.Cog.listener()
-    async def on_reaction_remove(self, reaction, user):
-        if reaction.message not in self.messages.keys():
-            return
-        
-        if user.bot:
+    async def on_raw_reaction_remove(self, payload:discord.RawReactionActionEvent) -> None:
+        if payload.message_id not in self.menus:
             return
-        
-        reaction_deleter = self.messages[reaction.message][0]
-        reaction_deleter.delete_now()
 
-    # If an user adds a reaction
-    @commands.Cog.listener()
-    async def on_reaction_add(self, reaction, user):
-        if reaction.message not in self.messages.keys():
+        if payload.user_id == self.bot.user.id:
             return
-        
-        if user.bot:
-            return
-
-        if reaction.emoji in self.emoji:
-            await self.handle_reactions(reaction, user)
 
+        # The bot removes the page reactions of users itself
+        if str(payload.emoji) in self.page_emoji:
+            return
 
-# Class to keep track on when to delete the reactions
-class ReactionDeleter():
-    def __init__(self, commands_object:Commands, message:discord.Message, timeout:int) -> None:
-        self.commands_object = commands_object
-        self.message = message
-        self.timeout = timeout
-        self.delete_time = get_unix_time() + self.timeout
-        asyncio.create_task(self.timer())
+        self.close_menu(payload.message_id)
 
-    # Sets a new timer for when the reaction need to be deleted. Handy if you want to overwrite the current timer
-    def next_delete(self, timeout:int) -> None:
-        self.delete_time = get_unix_time() + timeout
-        asyncio.create_task(self.timer())
+    # If an user adds a reaction
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload:discord.RawReactionActionEvent) -> None:
+        if payload.message_id in self.running:
+            if payload.member is not None and not payload.member.bot and str(payload.emoji) == self.cancel_emoji:
+                self.cancel_command(payload.message_id, payload.member)
+            return
 
-    # Immediately starts the task to delete all reactions
-    def delete_now(self) -> None:
-        asyncio.create_task(self.remove_reactions())
+        if payload.message_id not in self.menus:
+            return
 
-    # Starts the task to delete the reactions if the timer hasn't been overwritten
-    async def timer(self) -> None:
-        await asyncio.sleep(self.timeout)
+        if payload.member is None or payload.member.bot:
+            return
 
-        if get_unix_time() <= self.delete_time:
-            await self.remove_reactions()
+        emoji = str(payload.emoji)
+        if emoji not in self.emoji and emoji not in self.page_emoji:
+            return
 
-    # Removes all reactions
-    async def remove_reactions(self) -> None:
-        try:
-            await self.message.clear_reactions()
-        except (discord.errors.Forbidden, discord.errors.NotFound):
+        channel = self.bot.get_channel(payload.channel_id)
+        if channel is None:
             return
 
-        self.commands_object.remove_message(self.message)
+        await self.handle_reactions(channel.get_partial_message(payload.message_id), emoji, payload.member)
 
 
 # Adds the cog to the bot
@@ -218,6 +218,12 @@ class Settings(commands.Cog):
 
             await send(self.bot, ctx.channel, "successfully changed the embed colour")
 
+    # Toggles the timings in the footer of executed commands for everyone
+    @commands.command(name="debugtimings", aliases=["debug_timings"])
+    async def _debugtimings(self, ctx:commands.Context) -> None:
+        self.bot.debug_timings = not self.bot.debug_timings
+        await send(self.bot, ctx.channel, f"Timings in the footer are now {'enabled' if self.bot.debug_timings else 'disabled'}")
+
 
 # Adds the cog to the bot
 def setup(bot:commands.Bot) -> None:
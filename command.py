@@ -1,30 +1,106 @@
-import subprocess
+import asyncio
+import os
+import shlex
 from asyncio import TimeoutError
-from typing import List, Optional, Tuple
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
 
 import discord
 from discord.ext import commands
 
+from agent import AgentClient, AgentPool, AgentProcess
+from process import Process, user_options
+from timing import StageTimer
 from utils import send
 
 
+# Result of a command, it can still be used as the old (ok, stdout, stderr, missing input) tuple
+class CommandResult(NamedTuple):
+    ok : bool
+    stdout : Optional[str]
+    stderr : Optional[str]
+    missing_input : bool = False
+    # Seconds since the result was made if it came from the cache
+    cache_age : Optional[float] = None
+    # Exit code of the process, None if it didn't run
+    returncode : Optional[int] = None
+    # "timed out" or "cancelled" if the process was stopped before it finished
+    stopped : Optional[str] = None
+
+
+# Characters that mean something to a shell when they aren't quoted
+SHELL_CHARACTERS = set("|&;<>()$`*?[]~#\n")
+
+
+# Splits a command into arguments, every argument is split on its "{}" slots
+# Returns None if the command uses shell syntax and can only be run by a shell
+def compile_argv(command:str) -> Optional[Tuple[Tuple[str, ...], ...]]:
+    quote = ""
+    escaped = False
+    for character in command:
+        if escaped:
+            escaped = False
+        elif character == "\\" and quote != "'":
+            escaped = True
+        elif quote != "":
+            if character == quote:
+                quote = ""
+            # Variables and command substitution still work between double quotes
+            elif quote == '"' and character in "$`":
+                return None
+        elif character in "'\"":
+            quote = character
+        elif character in SHELL_CHARACTERS:
+            return None
+
+    try:
+        arguments = shlex.split(command)
+    except ValueError:
+        return None
+
+    # Variables set in front of the command
+    if len(arguments) == 0 or "=" in arguments[0]:
+        return None
+
+    return tuple(tuple(argument.split("{}")) for argument in arguments)
+
+
 # Class for commands
 class Command():
 
-    def __init__(self, name:str, server_command:bool, user:str, command:str, path:str, strip:bool) -> None:
+    def __init__(self, name:str, server_command:bool, user:str, command:str, path:str, strip:bool, cache_ttl:int=0, template:str="", timeout:int=0) -> None:
         self.name : str = name
         self.server_command = server_command
         self.user = user
         self.command = command
         self.path = path
         self.strip = strip
+        # Seconds the result can be reused, 0 if the command isn't read only
+        self.cache_ttl = cache_ttl
+        # Name of the command in commands.json
+        self.template = template
+        # Seconds before the process gets stopped, 0 to wait forever
+        self.timeout = timeout
         self.input = self.require_input()
+        # Compiled once so running the command doesn't need a shell, None if it does need one
+        self.argv = compile_argv(command)
+
+    # Everything that defines the command, used to compare commands between reloads
+    @property
+    def key(self) -> tuple:
+        return (self.name, self.server_command, self.user, self.command, self.path, self.strip, self.cache_ttl, self.template, self.timeout)
+
+    def __eq__(self, other:object) -> bool:
+        return isinstance(other, Command) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
 
     # Determine if command requires input
     def require_input(self) -> bool:
         return "{}" in self.command
 
     # Check if an argument tries to go to a different directory
+    # Every argument is a single argument of the process, so it only has to be a plain name
     def strip_str(self, msg:str) -> Tuple[bool, Optional[str]]:
         if msg.startswith("./"):
             msg = msg[2:]
@@ -33,7 +109,8 @@ class Command():
         if msg.endswith("/"):
             msg = msg[:-1]
 
-        if "/"  in msg:
+        # Options could change what the command does
+        if "/" in msg or "\0" in msg or msg in ("", ".", "..") or msg.startswith("-"):
             return False, None
 
         return True, msg
@@ -49,17 +126,12 @@ class Command():
         except TimeoutError:
             return False, None
 
-        arguments = []
-
         await or_msg.delete()
-        msg = msg.content
-        while msg.find('"') != -1:
-            index_1 = msg.find('"')
-            index_2 = msg.find('"', index_1 + 1)
-            arguments.push(msg[index_1 + 1:index_2])
-            msg = msg.replace(msg[index_1:index_2 + 1], "")
-
-        [arguments.append(x) for x in msg.split(" ")]
+        try:
+            arguments = shlex.split(msg.content)
+        except ValueError:
+            return False, None
+
         if len(arguments) != self.command.count("{}"):
             return False, None
 
@@ -70,36 +142,118 @@ class Command():
                 result = self.strip_str(arg)
                 if not result[0]:
                     return False, None
-                arguments.append(arg)
+                arguments.append(result[1])
 
         return True, arguments
         
-    # Executes a command
-    async def execute(self, bot:commands.Bot, channel:discord.TextChannel, author:discord.Member) -> Tuple[bool, Optional[str], Optional[str], Optional[bool]]:
-        command = self.command
-        
-        if self.input:
-            input_result = await self.ask_for_input(bot, channel, author)
-            if not input_result[0]:
-                return False, None, None, True
+    # Gets the arguments for the command, asks the user for them if required
+    async def get_arguments(self, bot:commands.Bot, channel:discord.TextChannel, author:discord.Member) -> Tuple[bool, Optional[List[str]]]:
+        if not self.input:
+            return True, []
+
+        return await self.ask_for_input(bot, channel, author)
 
-            # Formats the command
-            for input in input_result[1]:
-                command = command.replace("{}", f'"{input}"', 1)
+    # Fills the slots of the compiled command with the arguments
+    def format_argv(self, arguments:List[str]) -> List[str]:
+        inputs = iter(arguments)
+        argv = []
+        for pieces in self.argv:
+            argument = pieces[0]
+            for piece in pieces[1:]:
+                argument += next(inputs) + piece
+            argv.append(argument)
 
+        # Server commands are arguments of the LinuxGSM script
         if self.server_command:
+            return [self.path] + argv
+
+        return argv
+
+    # Makes the process for a command without starting it
+    # Compiled commands are executed directly as the user, with an agent if there is one
+    # Commands that need a shell still go through one, with the arguments quoted
+    def make_process(self, arguments:List[str], agent:Optional[Union[AgentClient, AgentPool]]=None) -> Union[Process, AgentProcess]:
+        cwd = os.path.dirname(self.path) if self.server_command else self.path
+
+        if self.argv is not None:
+            argv = self.format_argv(arguments)
+            if agent is not None:
+                return agent.process(argv, cwd, self.user)
             if self.user == "":
-                command_array = [f"{self.path} {command}"]
-            else:
-                command_array = ["su", "-c", f"{self.path} {command}", "-", self.user]
-        else:
-            if self.user == "":
-                command_array = [f"(cd {self.path} && {command})"]
-            else:
-                command_array = ["su", "-c", f"(cd {self.path} && {command})", self.user]
+                return Process(argv, cwd=cwd)
+            return Process(argv, cwd=cwd, **user_options(self.user))
+
+        command = self.command
+
+        # Formats the command
+        for input in arguments:
+            command = command.replace("{}", shlex.quote(input), 1)
+
+        if agent is not None:
+            if self.server_command:
+                return agent.process(["/bin/sh", "-c", f"{shlex.quote(self.path)} {command}"], cwd, self.user)
+            return agent.process(["/bin/sh", "-c", command], cwd, self.user)
+
+        if self.server_command:
+            command = f"{shlex.quote(self.path)} {command}"
+
+        # Without a user the command is run by a shell as the bot's own user
+        if self.user == "":
+            return Process([command], shell=True, cwd=cwd)
+
+        # su starts in the home of the user, so the shell changes the directory itself
+        if self.server_command:
+            return Process(["su", "-c", f"(cd {shlex.quote(cwd)} && {command})", "-", self.user])
+        return Process(["su", "-c", f"(cd {shlex.quote(cwd)} && {command})", self.user])
+
+    # Executes a command
+    # on_line gets called with the stream name and the line for every line of output
+    # The process group gets stopped when the timeout passes, cancel gets set or the caller stops waiting
+    async def execute(self, arguments:List[str], on_line:Optional[Callable[[str, str], None]]=None, timer:Optional[StageTimer]=None, cancel:Optional[asyncio.Event]=None, agent:Optional[Union[AgentClient, AgentPool]]=None) -> CommandResult:
+        if timer is None:
+            timer = StageTimer()
 
         try:
-            result = subprocess.run(command_array, capture_output=True, text=True)
+            with timer.stage("spawn"):
+                process = self.make_process(arguments, agent)
+                await process.start()
         except FileNotFoundError:
-            return False, "", f"`{' '.join(command_array)}` could not be executed\nCheck if the file location is right"
-        return result.returncode == 0, result.stdout, result.stderr
+            return CommandResult(False, "", f"`{self.command}` could not be executed\nCheck if the file location is right")
+        except OSError as error:
+            return CommandResult(False, "", f"`{self.command}` could not be executed\n{error}")
+
+        async def read_output() -> None:
+            async for stream, line in process.lines():
+                if on_line is not None:
+                    on_line(stream, line)
+
+        reader = asyncio.ensure_future(read_output())
+        waiters = {reader}
+        if cancel is not None:
+            waiters.add(asyncio.ensure_future(cancel.wait()))
+
+        finished = False
+        try:
+            with timer.stage("runtime"):
+                await asyncio.wait(waiters, timeout=self.timeout if self.timeout > 0 else None, return_when=asyncio.FIRST_COMPLETED)
+            finished = reader.done()
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+            if not finished:
+                try:
+                    await process.kill()
+                except ConnectionError:
+                    pass
+
+        if not finished:
+            stopped = "cancelled" if cancel is not None and cancel.is_set() else "timed out"
+            return CommandResult(False, process.stdout, process.stderr, returncode=process.returncode, stopped=stopped)
+
+        # The connection to an agent can be lost while the command runs
+        try:
+            reader.result()
+        except ConnectionError as error:
+            return CommandResult(False, process.stdout, f"{process.stderr}\n{error}".lstrip("\n"), returncode=process.returncode)
+
+        return CommandResult(process.returncode == 0, process.stdout, process.stderr, returncode=process.returncode)
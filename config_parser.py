@@ -1,9 +1,14 @@
+import gc
+import hashlib
 import os
-from typing import List, Optional, Tuple, Union
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from discord import Activity, ActivityType, Color, Game
 
 from command import Command
+from query import protocols
 from server import Server
 from utils import exit, print_to_console, read_file
 
@@ -18,9 +23,16 @@ commands_required_values = ["server command", "command", "require path", "strip
 server_required_values = ["name", "path", "head admin", "admin", "moderator", "commands"]
 server_commands_requires_values = ["name", "user", "command"]
 
+config_files = ["./configs/settings.json", "./configs/commands.json", "./configs/servers.json"]
+
+# The snapshot holds the parsed commands and servers, it's only used if the config files and the results of the path checks didn't change
+snapshot_file = "./cache/config.pickle"
+# Has to be raised whenever the Server or Command classes change
+snapshot_version = 9
+
 forbidden_server_names = ["restart", "reload", "refresh", "settings", "setting", "setprefix", "set_prefix", "setactivity", "set_activity", "set_activity_type", "set_activity_text", "set_activitytype", "set_activitytext", "setactivitytype", 
                         "setactivitytext", "setheadadmin", "set_head_admin", "set_headadmin", "setadmin", "set_admin", "setmoderator", "set_moderator", "setembedcolour", "set_embed_colour", "set_embed_color", "set_embedcolour", "set_embedcolor", 
-                        "setembedcolor", "set_colour", "set_color", "setcolour", "setcolor", "servers"]
+                        "setembedcolor", "set_colour", "set_color", "setcolour", "setcolor", "servers", "timings", "debugtimings", "debug_timings", "group"]
 
 
 ###########
@@ -74,6 +86,45 @@ def check_bool(data:Union[str, int, bool]) -> Tuple[bool, Optional[bool]]:
     print(type(data))
     return False, None
 
+# Makes a relative command path relative to the directory of the server script
+def resolve_command_path(server_path:str, command_path:str) -> str:
+    if command_path.startswith("./"):
+        return server_path[:server_path.rfind("/")] + command_path[1:]
+
+    return command_path
+
+# Returns every path of a server that has to be checked
+def server_paths(server_data:dict, template_commands:dict) -> List[str]:
+    if not isinstance(server_data, dict) or not isinstance(server_data.get("path"), str):
+        return []
+
+    # The paths of servers on other hosts can't be checked from here
+    if "node" in server_data:
+        return []
+
+    paths = [server_data["path"]]
+    if isinstance(server_data.get("commands"), dict):
+        for command_data in server_data["commands"].values():
+            if not isinstance(command_data, dict) or not isinstance(command_data.get("path"), str):
+                continue
+            template = template_commands.get(command_data.get("command"))
+            if template is not None and template[2]:
+                paths.append(resolve_command_path(server_data["path"], command_data["path"]))
+
+    return paths
+
+# Checks if paths exist and are executable
+# Every check can take a while on network storage so they all run at the same time
+def check_paths(paths:Iterable[str]) -> Dict[str, Tuple[bool, bool]]:
+    unique_paths = list(dict.fromkeys(paths))
+    if len(unique_paths) == 0:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(32, len(unique_paths))) as executor:
+        results = executor.map(lambda path: (os.path.exists(path), os.access(path, os.X_OK)), unique_paths)
+
+        return dict(zip(unique_paths, results))
+
 
 ###################
 #  settings.json  #
@@ -81,7 +132,7 @@ def check_bool(data:Union[str, int, bool]) -> Tuple[bool, Optional[bool]]:
 
 
 # Parses the settings file
-def parse_settings() -> Tuple[str, str, Activity, int, int, int, int, Color]:
+def parse_settings() -> Tuple[str, str, Activity, int, int, int, int, Color, int, int, int, int, str, Dict[str, Tuple[str, int, str]]]:
     data = read_file("./configs/settings.json")
 
     check_values = check_required_values(settings_required_values, data)
@@ -147,135 +198,337 @@ def parse_settings() -> Tuple[str, str, Activity, int, int, int, int, Color]:
         
         embed_colour = Color.from_rgb(embed_colour[0], embed_colour[1], embed_colour[2])
 
-    return prefix, token, activity, guild, head_admin, admin, moderator, embed_colour
+    # Optional limit on how many commands can run at the same time across all servers
+    max_jobs = data.get("max concurrent jobs", 4)
+    if isinstance(max_jobs, str) and max_jobs.isdigit():
+        max_jobs = int(max_jobs)
+    if isinstance(max_jobs, bool) or not isinstance(max_jobs, int) or max_jobs < 1:
+        exit("'max concurrent jobs' has to be a number bigger than 0. Remove it to use the default of 4.")
+
+    # Optional amount of seconds between checks for changes in commands.json and servers.json
+    reload_interval = data.get("config reload interval", 5)
+    if isinstance(reload_interval, str) and reload_interval.isdigit():
+        reload_interval = int(reload_interval)
+    if isinstance(reload_interval, bool) or not isinstance(reload_interval, int) or reload_interval < 0:
+        exit("'config reload interval' has to be a positive number. Set it to 0 to disable automatic reloading.")
+
+    # Optional amount of seconds between queries to the game servers
+    status_interval = data.get("status poll interval", 30)
+    if isinstance(status_interval, str) and status_interval.isdigit():
+        status_interval = int(status_interval)
+    if isinstance(status_interval, bool) or not isinstance(status_interval, int) or status_interval < 0:
+        exit("'status poll interval' has to be a positive number. Set it to 0 to disable the server status.")
+
+    # Optional local port for the Prometheus metrics endpoint
+    metrics_port = data.get("metrics port", 0)
+    if isinstance(metrics_port, str) and metrics_port.isdigit():
+        metrics_port = int(metrics_port)
+    if isinstance(metrics_port, bool) or not isinstance(metrics_port, int) or not 0 <= metrics_port <= 65535:
+        exit("'metrics port' has to be a port number. Set it to 0 to disable the metrics endpoint.")
+
+    # Optional unix socket of the agent that runs the commands instead of su
+    agent_socket = data.get("agent socket", "")
+    if not isinstance(agent_socket, str):
+        exit("'agent socket' has to be the path of the agent's socket. Leave it empty to run the commands with su.")
+
+    # Optional agents on other hosts, servers with a node run their commands there
+    nodes = {}
+    nodes_data = data.get("nodes", {})
+    if not isinstance(nodes_data, dict):
+        exit("'nodes' has to be an object with a host, port and token for every node.")
+    for node_name, node_data in nodes_data.items():
+        if not isinstance(node_data, dict) or not isinstance(node_data.get("host"), str) or not isinstance(node_data.get("token"), str):
+            exit(f"Node '{node_name}' needs a host, port and token.")
+
+        node_port = node_data.get("port")
+        if isinstance(node_port, str) and node_port.isdigit():
+            node_port = int(node_port)
+        if isinstance(node_port, bool) or not isinstance(node_port, int) or not 0 < node_port <= 65535:
+            exit(f"The port of node '{node_name}' has to be a port number.")
+
+        if len(node_data["token"]) < 16:
+            exit(f"The token of node '{node_name}' has to be at least 16 characters long.")
+
+        nodes[node_name] = (node_data["host"], node_port, node_data["token"])
+
+    return prefix, token, activity, guild, head_admin, admin, moderator, embed_colour, max_jobs, reload_interval, status_interval, metrics_port, agent_socket, nodes
+
+# Parses a single command from the commands file
+def parse_command(command:str, command_data:dict) -> Optional[list]:
+    # Has all the values
+    check_values = check_required_values(commands_required_values, command_data)
+    if not check_values[0]:
+        print_to_console(f"'{command}' will not be added as a command because it doesn't have a value for '{check_values[1]}'.")
+        return None
+
+    # TODO Shorten 
+    server_command = check_bool(command_data["server command"])
+    if not server_command[0]:
+        print_to_console(f"'{command}' will not be added as the option 'server command' is not a boolean.")
+        return None
+    server_command = server_command[1]
+
+    require_path = check_bool(command_data["require path"])
+    if not require_path[0]:
+        print_to_console(f"'{command}' will not be added as the option 'require path' is not a boolean.")
+        return None
+    require_path = require_path[1]
+
+    strip_user_input = check_bool(command_data["strip user input"])
+    if not strip_user_input[0]:
+        print_to_console(f"'{command}' will not be added as the option 'strip user input' is not a boolean.")
+        return None
+    strip_user_input = strip_user_input[1]
+
+    actual_command = command_data["command"]
+
+    # Optional amount of seconds the result of a read only command can be reused
+    cache_ttl = command_data.get("cache", 0)
+    if isinstance(cache_ttl, str) and cache_ttl.isdigit():
+        cache_ttl = int(cache_ttl)
+    if isinstance(cache_ttl, bool) or not isinstance(cache_ttl, int) or cache_ttl < 0:
+        print_to_console(f"'{command}' will not be added as the option 'cache' is not a positive number.")
+        return None
+
+    # Optional amount of seconds before the command gets stopped
+    timeout = command_data.get("timeout", 0)
+    if isinstance(timeout, str) and timeout.isdigit():
+        timeout = int(timeout)
+    if isinstance(timeout, bool) or not isinstance(timeout, int) or timeout < 0:
+        print_to_console(f"'{command}' will not be added as the option 'timeout' is not a positive number.")
+        return None
+
+    return [server_command, actual_command, require_path, strip_user_input, cache_ttl, timeout]
 
 # Parses the commands file
-def parse_commands() -> dict:
-    data = read_file("./configs/commands.json")
+def parse_commands(data:Optional[dict]=None) -> dict:
+    if data is None:
+        data = read_file("./configs/commands.json")
 
     all_commands = {}
 
     for command in data:
-        # Has all the values
-        check_values = check_required_values(commands_required_values, data[command])
-        if not check_values[0]:
-            print_to_console(f"'{command}' will not be added as a command because it doesn't have a value for '{check_values[1]}'.")
-            continue
+        template = parse_command(command, data[command])
+        if template is not None:
+            all_commands[command] = template
+        
+    return all_commands
 
-        # TODO Shorten 
-        server_command = check_bool(data[command]["server command"])
-        if not server_command[0]:
-            print_to_console(f"'{command}' will not be added as the option 'server command' is not a boolean.")
-            continue
-        server_command = server_command[1]
+# Parses the optional query address of a server
+def parse_query(server_name:str, query_data:dict) -> Optional[Tuple[str, int, str]]:
+    if not isinstance(query_data, dict) or not isinstance(query_data.get("host"), str) or query_data["host"] == "":
+        print_to_console(f"The status of '{server_name}' will not be shown as 'query' needs a 'host'.")
+        return None
+
+    port = query_data.get("port", 27015)
+    if isinstance(port, str) and port.isdigit():
+        port = int(port)
+    if isinstance(port, bool) or not isinstance(port, int) or not 0 < port < 65536:
+        print_to_console(f"The status of '{server_name}' will not be shown as '{port}' is not a valid port.")
+        return None
+
+    protocol = query_data.get("protocol", "a2s")
+    if protocol not in protocols:
+        print_to_console(f"The status of '{server_name}' will not be shown as the protocol '{protocol}' isn't supported. Use one of {', '.join(protocols)}.")
+        return None
+
+    return query_data["host"], port, protocol
+
+# Parses a single server from the servers file
+# server_names are the names that are already taken
+# path_checks are the results of check_paths, the paths of the server get checked if they're not given
+def parse_server(server_keyname:str, server_data:dict, template_commands:dict, server_names:Set[str], path_checks:Optional[Dict[str, Tuple[bool, bool]]]=None) -> Optional[Server]:
+    # Check for required values
+    check_values = check_required_values(server_required_values, server_data)
+    if not check_values[0]:
+        print_to_console(f"'{server_keyname}' will not be added as it does not have '{check_values[1]}'.")
+        return None
+
+    server_name = server_data["name"]
+    server_path = server_data["path"]
+
+    # Check for forbidden server names
+    if server_name in forbidden_server_names:
+        print_to_console(f"'{server_name}' will not be added as it's name is the same as one of the built in commands.")
+        return None
+
+    # Optional agent on another host that runs the commands
+    server_node = server_data.get("node")
+    if server_node is not None and (not isinstance(server_node, str) or server_node == ""):
+        print_to_console(f"'{server_name}' will not be added as it's node is not a name.")
+        return None
+
+    if path_checks is None:
+        path_checks = check_paths(server_paths(server_data, template_commands))
+
+    # Basic checks for the file, only possible on this host
+    if server_node is None and not path_checks.get(server_path, (False, False))[0]:
+        print_to_console(f"'{server_name}' will not be added as the given path '{server_path}' does not exists.")
+        return None
+
+    if server_node is None and not path_checks[server_path][1]:
+        print_to_console(f"'{server_name}' will not be added as the given path '{server_path}' is not executable.")
+        return None
+
+    # No duplicates allowed
+    if server_name in server_names:
+        print_to_console(f"'{server_name}' will not be added as there's already another server with that name.")
+        return None
+
+    server = Server(server_name, server_path)
+    server.node = server_node
+
+    # Optional address to query the status of the game server
+    if "query" in server_data:
+        server.query = parse_query(server_name, server_data["query"])
+
+    # Optional category to run commands on multiple servers at once
+    if "category" in server_data:
+        if isinstance(server_data["category"], str) and server_data["category"] != "":
+            server.category = server_data["category"]
+        else:
+            print_to_console(f"The category of '{server_name}' will be ignored as it's not a text.")
 
-        require_path = check_bool(data[command]["require path"])
-        if not require_path[0]:
-            print_to_console(f"'{command}' will not be added as the option 'require path' is not a boolean.")
-            continue
-        require_path = require_path[1]
+    head_admin_commands = server_data["head admin"]
+    admin_commands = server_data["admin"]
+    moderator_commands = server_data["moderator"]
 
-        strip_user_input = check_bool(data[command]["strip user input"])
-        if not strip_user_input[0]:
-            print_to_console(f"'{command}' will not be added as the option 'strip user input' is not a boolean.")
+    has_commands = False
+    for command_data in server_data["commands"]:
+        check_values = check_required_values(server_commands_requires_values, server_data["commands"][command_data])
+        if not check_values[0]:
+            print_to_console(f"'{command_data}' will not be added to '{server_name}' as it does not have '{check_values[1]}'")
             continue
-        strip_user_input = strip_user_input[1]
-
-        actual_command = data[command]["command"]
 
-        all_commands[command] = [server_command, actual_command, require_path, strip_user_input]
-        
-    return all_commands
+        if server_data["commands"][command_data]["command"] not in template_commands:
+            print_to_console(f"'{command_data}' will not be added to '{server_name}' as the command '{server_data['commands'][command_data]['command']}' is not in commands.json")
+            continue
 
-# Parses the servers file
-def parse_servers(template_commands:dict) -> List[Server]:
-    data = read_file("./configs/servers.json")
-    all_servers = []
+        command_name = server_data["commands"][command_data]["name"]
+        command_user = server_data["commands"][command_data]["user"]
+        command_command = server_data["commands"][command_data]["command"]
 
-    for server_keyname in data:
-        # Check for required values
-        check_values = check_required_values(server_required_values, data[server_keyname])
-        if not check_values[0]:
-            print_to_console(f"'{server_name}' will not be added as it does not have '{check_values[1]}'.")
-            continue
+        if template_commands[server_data['commands'][command_data]['command']][2]:
+            try:
+                command_path = server_data["commands"][command_data]["path"]
+            except KeyError:
+                print_to_console(f"'{command_data}' will not be added to '{server_name}' as the command '{server_data['commands'][command_data]['command']}' requires a path")
+                continue
+            # Format path if it's a relative path
+            command_path = resolve_command_path(server_path, command_path)
 
-        server_name = data[server_keyname]["name"]
-        server_path = data[server_keyname]["path"]
+            if server_node is None and not path_checks.get(command_path, (False, False))[0]:
+                print_to_console(f"'{command_data}' will not be added to '{server_name}' as the given path '{command_path}' does not exists")
+                continue
+        # Server commands are run with the LinuxGSM script, other commands run in its directory
+        elif template_commands[command_command][0]:
+            command_path = server_path
+        else:
+            command_path = os.path.dirname(server_path)
 
-        # Check for forbidden server names
-        if server_name in forbidden_server_names:
-            print_to_console(f"'{server_name}' will not be added as it's name is the same as one of the built in commands.")
-            return
+        command = Command(command_name, template_commands[command_command][0], command_user, template_commands[command_command][1], command_path, template_commands[command_command][3], template_commands[command_command][4], command_command, template_commands[command_command][5])
 
-        # Basic checks for the file
-        if not os.path.exists(server_path):
-            print_to_console(f"'{server_name}' will not be added as the given path '{server_path}' does not exists.")
-            continue
+        if command_name in head_admin_commands:
+            server.add_head_admin_command(command)
+        elif command_name in admin_commands:
+            server.add_admin_command(command)
+        elif command_name in moderator_commands:
+            server.add_moderator_command(command)
+        else:
+            print_to_console(f"'{command_name}' will not be added to '{server_name}' because it's not added to the head admin, admin or moderators commands")
 
-        if not os.access(server_path, os.X_OK):
-            print_to_console(f"'{server_name}' will not be added as the given path '{server_path}' is not executable.")
-            continue
+        if not has_commands:
+            has_commands = True
 
-        # No duplicates allowed
-        for s in all_servers:
-            if s.name == server_name:
-                print_to_console(f"'{server_name}' will not be added as there's already another server with that name.")
-                continue
+    if not has_commands:
+        print_to_console(f"'{server_name}' will not be added as it doesn't have any valid commands.")
+        return None
 
-        server = Server(server_name, server_path)
+    server.build_permissions()
+    return server
 
-        head_admin_commands = data[server_keyname]["head admin"]
-        admin_commands = data[server_keyname]["admin"]
-        moderator_commands = data[server_keyname]["moderator"]
+# Checks the paths of every server in the servers file
+def server_path_checks(data:dict, template_commands:dict) -> Dict[str, Tuple[bool, bool]]:
+    return check_paths(path for server_keyname in data for path in server_paths(data[server_keyname], template_commands))
 
-        has_commands = False
-        for command_data in data[server_keyname]["commands"]:
-            check_values = check_required_values(server_commands_requires_values, data[server_keyname]["commands"][command_data])
-            if not check_values[0]:
-                print_to_console(f"'{command_data}' will not be added to '{server_name}' as it does not have '{check_values[1]}'")
-                continue
+# Parses the servers file
+def parse_servers(template_commands:dict, data:Optional[dict]=None, path_checks:Optional[Dict[str, Tuple[bool, bool]]]=None) -> List[Server]:
+    if data is None:
+        data = read_file("./configs/servers.json")
 
-            if data[server_keyname]["commands"][command_data]["command"] not in template_commands:
-                print_to_console(f"'{command_data}' will not be added to '{server_name}' as the command '{data[server_keyname]['commands'][command_data]['command']}' is not in commands.json")
-                continue
+    all_servers = []
+    server_names = set()
 
-            command_name = data[server_keyname]["commands"][command_data]["name"]
-            command_user = data[server_keyname]["commands"][command_data]["user"]
-            command_command = data[server_keyname]["commands"][command_data]["command"]
-
-            if template_commands[data[server_keyname]['commands'][command_data]['command']][2]:
-                try:
-                    command_path = data[server_keyname]["commands"][command_data]["path"]
-                except KeyError:
-                    print_to_console(f"'{command_data}' will not be added to '{server_name}' as the command '{data[server_keyname]['commands'][command_data]['command']}' requires a path")
-                    continue
-                # Format path if it's a relative path
-                if command_path.startswith("./"):
-                    command_path = server_path[:server_path.rfind("/")] + command_path[1:]
-            else:
-                command_path = server_path
-
-            command = Command(command_name, template_commands[command_command][0], command_user, template_commands[command_command][1], command_path, template_commands[command_command][3])
-
-            if command_name in head_admin_commands:
-                server.add_head_admin_command(command)
-            elif command_name in admin_commands:
-                server.add_admin_command(command)
-            elif command_name in moderator_commands:
-                server.add_moderator_command(command)
-            else:
-                print_to_console(f"'{command_name}' will not be added to '{server_name}' because it's not added to the head admin, admin or moderators commands")
-
-            if not has_commands:
-                has_commands = True
+    # All file system checks are done up front, the results are handled in order
+    if path_checks is None:
+        path_checks = server_path_checks(data, template_commands)
 
-        if not has_commands:
-            print_to_console(f"'{server_name}' will not be added as it doesn't have any valid commands.")
+    for server_keyname in data:
+        server = parse_server(server_keyname, data[server_keyname], template_commands, server_names, path_checks)
+        if server is None:
             continue
 
+        server_names.add(server.name)
         all_servers.append(server)
 
     if len(all_servers) == 0:
         exit("There are no servers with any valid commands.")
 
     return all_servers
+
+
+##############
+#  Snapshot  #
+##############
+
+
+# Returns a hash of the content of all config files
+def config_hash() -> str:
+    sha = hashlib.sha256(str(snapshot_version).encode())
+    for file_location in config_files:
+        sha.update(file_location.encode())
+        try:
+            with open(file_location, "rb") as file:
+                sha.update(file.read())
+        except FileNotFoundError:
+            sha.update(b"missing")
+
+    return sha.hexdigest()
+
+# Loads the parsed commands and servers if the snapshot was made from the same config files
+# The paths are checked again, a server can become valid or invalid without any config file changing
+def load_snapshot(content_hash:str) -> Optional[Tuple[dict, List[Server], Dict[str, Tuple[bool, bool]]]]:
+    # The garbage collector would otherwise run over and over while the objects are made
+    gc.disable()
+    try:
+        with open(snapshot_file, "rb") as file:
+            data = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    # A snapshot from an older version or a broken file gets replaced
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError):
+        return None
+    finally:
+        gc.enable()
+
+    if not isinstance(data, tuple) or len(data) != 4 or data[0] != content_hash:
+        return None
+
+    if check_paths(data[3]) != data[3]:
+        return None
+
+    return data[1], data[2], data[3]
+
+# Saves the parsed commands and servers with the results of the path checks they were parsed with
+# The file is replaced at once so a crash can't leave half a snapshot behind
+def save_snapshot(content_hash:str, template_commands:dict, servers:List[Server], path_checks:Dict[str, Tuple[bool, bool]]) -> bool:
+    try:
+        os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+        with open(snapshot_file + ".tmp", "wb") as file:
+            pickle.dump((content_hash, template_commands, list(servers), path_checks), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshot_file + ".tmp", snapshot_file)
+    except (OSError, pickle.PicklingError, TypeError) as error:
+        print_to_console(f"Could not save the config snapshot because '{error}'")
+        return False
+
+    return True
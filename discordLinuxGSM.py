@@ -1,8 +1,19 @@
+from typing import Optional
+
 import discord
 from discord.ext import commands
 
-from config_parser import parse_commands, parse_servers, parse_settings
-from utils import print_to_console, send
+from agent import AgentClient, AgentPool
+from audit import AuditLog
+from cache import ResultCache
+from config_parser import config_hash, load_snapshot, parse_commands, parse_servers, parse_settings, save_snapshot, server_path_checks
+from flight import SingleFlight
+from metrics import Metrics
+from query import StatusPoller
+from reloader import ConfigReloader
+from scheduler import Scheduler
+from timing import StageStats
+from utils import print_to_console, read_file, send
 
 
 ###############
@@ -14,9 +25,32 @@ from utils import print_to_console, send
 def get_prefix(bot:commands.Bot, message:discord.Message) -> str:
     return bot.prefix
 
+# Class for the bot, it writes what's left of the audit log before it closes
+class LinuxGSMBot(commands.Bot):
+    async def close(self) -> None:
+        try:
+            await self.audit_log.stop()
+        finally:
+            await super().close()
+
 # Make bot
-def make_bot(bot:commands.Bot, settings_data:dict, servers_data:dict) -> None:
+def make_bot(bot:commands.Bot, settings_data:dict, commands_data:dict, servers_data:dict, path_checks:Optional[dict]=None) -> None:
     set_bot_variables(bot, settings_data, servers_data)
+    bot.scheduler = Scheduler(bot.max_jobs)
+    bot.result_cache = ResultCache()
+    bot.audit_log = AuditLog()
+    bot.agent = AgentClient(bot.agent_socket) if bot.agent_socket != "" else None
+    bot.nodes = {name: AgentPool(*node) for name, node in bot.node_settings.items()}
+    bot.stage_stats = StageStats()
+    bot.debug_timings = False
+    bot.metrics = Metrics(port=bot.metrics_port)
+    bot.metrics.add_gauge("linuxgsm_queue_depth", "Commands waiting for a slot.", lambda: bot.scheduler.queue_depth)
+    bot.metrics.add_gauge("linuxgsm_running_commands", "Commands that are running.", lambda: len(bot.scheduler.running))
+    bot.metrics.add_gauge("linuxgsm_open_menus", "Menus that are waiting for a reaction.", lambda: len(bot.get_cog("Commands").menus) if bot.get_cog("Commands") is not None else 0)
+    bot.metrics.add_gauge("linuxgsm_servers", "Servers in the config.", lambda: len(bot.servers))
+    bot.single_flight = SingleFlight()
+    bot.reloader = ConfigReloader(bot, commands_data, bot.reload_interval, path_checks)
+    bot.status_poller = StatusPoller(bot.status_interval)
 
     bot.remove_command("help")
     try:
@@ -33,6 +67,12 @@ def set_bot_variables(bot:commands.Bot, settings_data:dict, servers_data:dict) -
     bot.admin = settings_data[5]
     bot.moderator = settings_data[6]
     bot.embed_colour = settings_data[7]
+    bot.max_jobs = settings_data[8]
+    bot.reload_interval = settings_data[9]
+    bot.status_interval = settings_data[10]
+    bot.metrics_port = settings_data[11]
+    bot.agent_socket = settings_data[12]
+    bot.node_settings = settings_data[13]
     bot.servers = servers_data
 
 # Tries to convert the settings to objects
@@ -60,24 +100,35 @@ async def startup_check(bot:commands.Bot) -> None:
 print_to_console("1/5 Parsing the settings file...")
 settings_data = parse_settings()
 
-# Commands
-print_to_console("2/5 Parsing the commands file...")
-commands_data = parse_commands()
+# Commands and servers, the snapshot skips parsing if nothing changed since the last start
+content_hash = config_hash()
+snapshot = load_snapshot(content_hash)
+if snapshot is not None:
+    print_to_console("2/5 Loading the commands and servers from the snapshot...")
+    commands_data, servers_data, path_checks = snapshot
+    print_to_console(f"3/5 Loaded {len(servers_data)} server(s) from the snapshot...")
+else:
+    print_to_console("2/5 Parsing the commands file...")
+    commands_data = parse_commands()
 
-# Servers
-print_to_console("3/5 Parsing the servers file...")
-servers_data = parse_servers(commands_data)
+    print_to_console("3/5 Parsing the servers file...")
+    servers_file = read_file("./configs/servers.json")
+    path_checks = server_path_checks(servers_file, commands_data)
+    servers_data = parse_servers(commands_data, servers_file, path_checks)
+    save_snapshot(content_hash, commands_data, servers_data, path_checks)
 
 # Making the bot
 print_to_console("4/5 Making the bot...")
 
-bot = commands.Bot(
+# Menus work with the raw events, so the bot doesn't need to keep a message cache
+bot = LinuxGSMBot(
         command_prefix=get_prefix,
         intents=discord.Intents.default(),
-        activity=settings_data[2]
+        activity=settings_data[2],
+        max_messages=None
     )
 
-make_bot(bot, settings_data, servers_data)
+make_bot(bot, settings_data, commands_data, servers_data, path_checks)
 
 
 ##############################
@@ -90,23 +141,44 @@ make_bot(bot, settings_data, servers_data)
 async def right_guild(ctx) -> bool:
     return ctx.guild == bot.guild
 
-# Reloads both cogs
+# Reloads the settings and the changed servers
 @bot.command(name="restart", aliases=["reload"])
 async def _restart(ctx) -> None:
     msg = await send(bot, ctx, "Reloading the bot...")
 
     bot.unload_extension("cogs.settings")
-    bot.unload_extension("cogs.commands")
 
     settings_data = parse_settings()
-    commands_data = parse_commands()
-    servers_data = parse_servers(commands_data)
 
-    set_bot_variables(bot, settings_data, servers_data)
+    # Servers and open menus are kept, only the changed servers get replaced
+    set_bot_variables(bot, settings_data, bot.servers)
+    bot.scheduler.max_jobs = bot.max_jobs
+    bot.scheduler.dispatch()
+    bot.reloader.stop()
+    bot.reloader.interval = bot.reload_interval
+    bot.reloader.start()
+    await bot.reloader.reload(force=True)
+    bot.status_poller.stop()
+    bot.status_poller.interval = bot.status_interval
+    bot.status_poller.ttl = bot.status_interval * 2
+    bot.status_poller.start(lambda: bot.servers)
+    await bot.metrics.stop()
+    bot.metrics.port = bot.metrics_port
+    await bot.metrics.start()
+    # Commands that still run through an agent or node that changed get stopped
+    if bot.agent_socket != (bot.agent.socket_path if bot.agent is not None else ""):
+        if bot.agent is not None:
+            await bot.agent.close()
+        bot.agent = AgentClient(bot.agent_socket) if bot.agent_socket != "" else None
+    for name in list(bot.nodes):
+        if bot.node_settings.get(name) != (bot.nodes[name].host, bot.nodes[name].port, bot.nodes[name].token):
+            await bot.nodes.pop(name).close()
+    for name, node in bot.node_settings.items():
+        if name not in bot.nodes:
+            bot.nodes[name] = AgentPool(*node)
 
     try:
         bot.load_extension("cogs.settings")
-        bot.load_extension("cogs.commands")
     except commands.ExtensionFailed as error:
         await msg.edit(embed=discord.Embed(description="Failed to reload the bot\nPlease look at the console to see what went wrong", color=bot.embed_colour))
         exit(f"Failed to reload '{error.name}' because '{error.original}'")
@@ -114,25 +186,17 @@ async def _restart(ctx) -> None:
     await startup_check(bot)
     await msg.edit(embed=discord.Embed(description="Reloaded bot", color=bot.embed_colour))
 
-# Refreshes the server list
+# Refreshes the changed servers and the servers whose files were added or removed
 @bot.command(name="refresh")
 async def _refresh(ctx) -> None:
     msg = await send(bot, ctx, "Refreshing all servers...")
 
-    bot.unload_extension("cogs.commands")
+    result = await bot.reloader.reload(force=True)
 
-    commands_data = parse_commands()
-    servers_data = parse_servers(commands_data)
-
-    bot.servers = servers_data
-
-    try:
-        bot.load_extension("cogs.commands")
-    except commands.ExtensionFailed as error:
-        await msg.edit(embed=discord.Embed(description="Failed to refresh the servers\nPlease look at the console to get more information", color=bot.embed_colour))
-        exit(f"Failed to refresh the servers because '{error.original}'")
-    
-    await msg.edit(embed=discord.Embed(description=f"Refreshed `{len(servers_data)}` server(s)", color=bot.embed_colour))
+    if result is None:
+        await msg.edit(embed=discord.Embed(description=f"Nothing changed, there are `{len(bot.servers)}` server(s)", color=bot.embed_colour))
+    else:
+        await msg.edit(embed=discord.Embed(description=f"Refreshed `{len(bot.servers)}` server(s)\n`{result[0]}` added ▫️ `{result[1]}` changed ▫️ `{result[2]}` removed", color=bot.embed_colour))
 
 # Ignore all errors
 @bot.event
@@ -149,6 +213,10 @@ async def on_command_error(ctx, error) -> None:
 @bot.event
 async def on_ready() -> None:
     await startup_check(bot)
+    bot.reloader.start()
+    bot.status_poller.start(lambda: bot.servers)
+    bot.audit_log.start()
+    await bot.metrics.start()
 
     print("\n\tBot started!")
     print("-"*34)
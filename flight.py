@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from command import CommandResult
+
+
+# Class for an execution that other identical requests can attach to
+class Flight():
+    def __init__(self, replay_size:int=50) -> None:
+        self.line_listeners : List[Callable[[str, str], None]] = []
+        self.queue_listeners : List[Callable[[int], Awaitable[None]]] = []
+        # Last lines and queue position so listeners that attach later catch up
+        self.lines : Deque[Tuple[str, str]] = deque(maxlen=replay_size)
+        self.position : Optional[int] = None
+        self.task : Optional[asyncio.Future] = None
+        # Gets set when any of the requests cancels
+        self.cancel = asyncio.Event()
+        self.cancel_watchers : List[asyncio.Future] = []
+
+    # Adds the callbacks of a request and brings them up to date
+    async def attach(self, on_queued:Optional[Callable[[int], Awaitable[None]]], on_line:Optional[Callable[[str, str], None]], cancel:Optional[asyncio.Event]=None) -> None:
+        if cancel is not None and not self.task.done():
+            self.cancel_watchers.append(asyncio.ensure_future(self.watch_cancel(cancel)))
+
+        if on_line is not None:
+            for stream, line in self.lines:
+                on_line(stream, line)
+            self.line_listeners.append(on_line)
+
+        if on_queued is not None:
+            self.queue_listeners.append(on_queued)
+            if self.position:
+                await on_queued(self.position)
+
+    # Cancels the flight once the request cancels
+    async def watch_cancel(self, cancel:asyncio.Event) -> None:
+        await cancel.wait()
+        self.cancel.set()
+
+    # Stops watching the requests
+    def stop_watching(self) -> None:
+        for watcher in self.cancel_watchers:
+            watcher.cancel()
+
+    # Passes an output line to every listener
+    def on_line(self, stream:str, line:str) -> None:
+        self.lines.append((stream, line))
+        for listener in self.line_listeners:
+            listener(stream, line)
+
+    # Passes the queue position to every listener, a failing listener doesn't stop the others
+    async def on_queued(self, position:int) -> None:
+        self.position = position
+        await asyncio.gather(*(listener(position) for listener in self.queue_listeners), return_exceptions=True)
+
+
+# Class that lets identical concurrent requests share a single execution
+class SingleFlight():
+    def __init__(self) -> None:
+        self.flights : Dict[Hashable, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self.flights)
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self.flights
+
+    # Runs execute once for every key that's in flight, every request gets the same result
+    # execute gets called with the on_queued and on_line callbacks and the cancel event of the flight
+    async def run(self, key:Hashable, execute:Callable[[Callable[[int], Awaitable[None]], Callable[[str, str], None], asyncio.Event], Awaitable[CommandResult]], on_queued:Optional[Callable[[int], Awaitable[None]]]=None, on_line:Optional[Callable[[str, str], None]]=None, cancel:Optional[asyncio.Event]=None) -> CommandResult:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self.flights[key] = flight
+            flight.task = asyncio.ensure_future(self.fly(key, flight, execute))
+
+        await flight.attach(on_queued, on_line, cancel)
+
+        # A request that gets cancelled doesn't cancel the execution for the others
+        return await asyncio.shield(flight.task)
+
+    # Executes and removes the flight once it's done
+    async def fly(self, key:Hashable, flight:Flight, execute:Callable[[Callable[[int], Awaitable[None]], Callable[[str, str], None], asyncio.Event], Awaitable[CommandResult]]) -> CommandResult:
+        try:
+            return await execute(flight.on_queued, flight.on_line, flight.cancel)
+        finally:
+            flight.stop_watching()
+            del self.flights[key]
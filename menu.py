@@ -0,0 +1,84 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import discord
+
+from command import Command
+
+
+# Class that adds the reactions of a menu in the background
+# discord.py queues requests on the same route, so the reactions still get added in order and within the rate limit
+class ReactionAdder():
+    def __init__(self, message:discord.Message, emoji:List[str], present:Optional[List[str]]=None) -> None:
+        self.message = message
+        self.emoji = emoji
+        self.tasks : List[asyncio.Task] = []
+        # Reactions that are on the message
+        self.present : List[str] = present.copy() if present is not None else []
+
+    # Schedules all reactions at once
+    def start(self) -> None:
+        self.tasks = [asyncio.create_task(self.add_reaction(emoji)) for emoji in self.emoji]
+
+    # Adds a single reaction
+    async def add_reaction(self, emoji:str) -> None:
+        try:
+            await self.message.add_reaction(emoji)
+            self.present.append(emoji)
+        except (discord.errors.Forbidden, discord.errors.NotFound):
+            self.cancel()
+
+    # Stops adding the reactions that haven't been added yet
+    def cancel(self) -> None:
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+
+
+# Class for an open menu
+# Only ids are kept so a menu doesn't depend on the message cache
+class Menu():
+    __slots__ = ("message_id", "channel_id", "server", "commands", "page", "reaction_adder")
+
+    def __init__(self, message_id:int, channel_id:int, server:str, commands:Tuple[Command, ...]) -> None:
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.server = server
+        self.commands = commands
+        self.page = 0
+        self.reaction_adder : Optional[ReactionAdder] = None
+
+
+# Class that keeps the open menus indexed by message id and by server
+class MenuRegistry():
+    def __init__(self) -> None:
+        self.by_message : Dict[int, Menu] = {}
+        self.by_server : Dict[str, Menu] = {}
+
+    # Amount of open menus
+    def __len__(self) -> int:
+        return len(self.by_message)
+
+    def __contains__(self, message_id:int) -> bool:
+        return message_id in self.by_message
+
+    # Adds a menu, a server can only have one menu
+    def add(self, menu:Menu) -> None:
+        self.by_message[menu.message_id] = menu
+        self.by_server[menu.server] = menu
+
+    # Returns the menu of a message
+    def get(self, message_id:int) -> Optional[Menu]:
+        return self.by_message.get(message_id)
+
+    # Returns the open menu of a server
+    def for_server(self, server:str) -> Optional[Menu]:
+        return self.by_server.get(server)
+
+    # Removes the menu of a message
+    def remove(self, message_id:int) -> Optional[Menu]:
+        menu = self.by_message.pop(message_id, None)
+        if menu is not None and self.by_server.get(menu.server) is menu:
+            del self.by_server[menu.server]
+
+        return menu
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+from utils import print_to_console
+
+
+# Buckets in seconds
+DISCORD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+RELOAD_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+###########
+#  Utils  #
+###########
+
+
+# Escapes a label value for the text format
+def escape(value:str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Returns the labels in the text format
+# le is the upper bound of a histogram bucket
+def format_labels(names:Tuple[str, ...], values:Tuple[str, ...], le:Optional[str]=None) -> str:
+    labels = [f"{name}=\"{escape(str(value))}\"" for name, value in zip(names, values)]
+    if le is not None:
+        labels.append(f"le=\"{le}\"")
+
+    return "{" + ",".join(labels) + "}" if len(labels) > 0 else ""
+
+
+#############
+#  Metrics  #
+#############
+
+
+# Class for a counter with labels
+class Counter():
+    def __init__(self, name:str, description:str, labels:Tuple[str, ...]=()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values : Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels:str, amount:float=1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+
+        return lines
+
+
+# Class for a histogram with labels
+class Histogram():
+    def __init__(self, name:str, description:str, buckets:Tuple[float, ...], labels:Tuple[str, ...]=()) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        # Per label combination the count per bucket (last one is +Inf), the sum and the count
+        self.values : Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value:float, *labels:str) -> None:
+        if labels not in self.values:
+            self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+
+        counts, total = self.values[labels]
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+        total[1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, str(bucket))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, '+Inf')} {total[1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total[0]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {total[1]}")
+
+        return lines
+
+
+# Class for a gauge that gets its value when it's scraped
+class Gauge():
+    def __init__(self, name:str, description:str, get_value:Callable[[], float]) -> None:
+        self.name = name
+        self.description = description
+        self.get_value = get_value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self.get_value()}"]
+
+
+# Class that collects the metrics of the bot and serves them in the Prometheus text format
+# Collecting is always on, the http endpoint only runs when a port is set
+class Metrics():
+    def __init__(self, host:str="127.0.0.1", port:int=0, lag_interval:float=1) -> None:
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.loop_lag = 0.0
+
+        self.command_duration = Histogram("linuxgsm_command_duration_seconds", "Time from the start of a command until its result, queue included.", COMMAND_BUCKETS, ("server", "command"))
+        self.discord_duration = Histogram("linuxgsm_discord_request_duration_seconds", "Duration of Discord API calls.", DISCORD_BUCKETS, ("call",))
+        self.discord_errors = Counter("linuxgsm_discord_request_errors_total", "Discord API calls that failed.", ("call", "error"))
+        self.reload_duration = Histogram("linuxgsm_config_reload_duration_seconds", "Duration of config reloads that found changes.", RELOAD_BUCKETS)
+        self.gauges : List[Gauge] = [Gauge("linuxgsm_event_loop_lag_seconds", "How late the event loop woke up during the last check.", lambda: self.loop_lag)]
+
+        self.runner : Optional[web.AppRunner] = None
+        self.lag_task : Optional[asyncio.Task] = None
+
+    # Adds a gauge that's read on every scrape
+    def add_gauge(self, name:str, description:str, get_value:Callable[[], float]) -> None:
+        self.gauges.append(Gauge(name, description, get_value))
+
+    def observe_command(self, server:str, command:str, duration:float) -> None:
+        self.command_duration.observe(duration, server, command)
+
+    def observe_reload(self, duration:float) -> None:
+        self.reload_duration.observe(duration)
+
+    # Times a Discord API call and counts it as failed if it raises
+    @contextmanager
+    def discord_call(self, call:str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as error:
+            self.discord_errors.inc(call, type(error).__name__)
+            raise
+        finally:
+            self.discord_duration.observe(time.monotonic() - start, call)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.command_duration, self.discord_duration, self.discord_errors, self.reload_duration, *self.gauges):
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+    ##############
+    #  Endpoint  #
+    ##############
+
+
+    async def handle_metrics(self, request:web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8", headers={"Cache-Control": "no-store"})
+
+    # Starts the http endpoint and the loop lag check
+    async def start(self) -> None:
+        if self.runner is not None or self.port == 0:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as error:
+            print_to_console(f"Could not start the metrics endpoint on port {self.port}: {error.strerror}")
+            await self.runner.cleanup()
+            self.runner = None
+            return
+
+        self.lag_task = asyncio.create_task(self.measure_lag())
+
+    async def stop(self) -> None:
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            self.lag_task = None
+
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    # Checks how much later than asked the loop wakes up
+    async def measure_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, loop.time() - start - self.lag_interval)
@@ -0,0 +1,177 @@
+import asyncio
+import gzip
+import io
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import discord
+
+
+# Class that shows the tail of a command's output in an embed while it runs
+class LiveOutput():
+    def __init__(self, message:discord.Message, embed:discord.Embed, header:str, interval:float=3, tail_size:int=1000) -> None:
+        self.message = message
+        self.embed = embed
+        self.header = header
+        self.interval = interval
+        self.tail_size = tail_size
+        self.lines : Deque[str] = deque()
+        self.size = 0
+        self.changed = False
+        self.task : Optional[asyncio.Task] = None
+
+    # Adds a line of output, only the last tail_size characters are kept
+    def add_line(self, stream:str, line:str) -> None:
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.tail_size and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft())
+
+        self.changed = True
+        if self.task is None:
+            self.task = asyncio.create_task(self.updater())
+
+    # Returns the current tail
+    def tail(self) -> str:
+        tail = "".join(self.lines)[-self.tail_size:]
+        # Code blocks can't be closed early by the output
+        return tail.replace("```", "`\u200b``")
+
+    # Edits the message at most once every interval seconds to stay within Discord's rate limits
+    async def updater(self) -> None:
+        while True:
+            if self.changed:
+                self.changed = False
+                self.embed.description = f"{self.header}\n```bash\n{self.tail()}```"
+                try:
+                    await self.message.edit(embed=self.embed)
+                except discord.errors.HTTPException:
+                    pass
+
+            await asyncio.sleep(self.interval)
+
+    # Stops updating the message
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+
+# Class that shows the status of every server of a group command in one embed
+class GroupOutput():
+    def __init__(self, message:discord.Message, embed:discord.Embed, header:str, names:List[str], interval:float=3, max_size:int=4000) -> None:
+        self.message = message
+        self.embed = embed
+        self.header = header
+        self.interval = interval
+        self.max_size = max_size
+        self.statuses : Dict[str, str] = {name: "⏳ Waiting" for name in names}
+        self.changed = False
+        self.task : Optional[asyncio.Task] = None
+
+    # Changes the status of a server
+    def set_status(self, name:str, status:str) -> None:
+        self.statuses[name] = status
+        self.changed = True
+        if self.task is None:
+            self.task = asyncio.create_task(self.updater())
+
+    # Returns the header with a line per server, the servers that don't fit get counted
+    def render(self) -> str:
+        description = f"{self.header}\n"
+        for i, (name, status) in enumerate(self.statuses.items()):
+            line = f"`{name}` ▫️ {status}\n"
+            if len(description) + len(line) > self.max_size - 50:
+                description += f"... and `{len(self.statuses) - i}` more server(s)"
+                break
+            description += line
+
+        return description
+
+    # Edits the message with the current statuses
+    async def update(self) -> None:
+        self.changed = False
+        self.embed.description = self.render()
+        try:
+            await self.message.edit(embed=self.embed)
+        except discord.errors.HTTPException:
+            pass
+
+    # Edits the message at most once every interval seconds to stay within Discord's rate limits
+    async def updater(self) -> None:
+        while True:
+            if self.changed:
+                await self.update()
+
+            await asyncio.sleep(self.interval)
+
+    # Stops updating the message
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+
+# Class that collects output in memory and turns it into attachments
+# Once the output passes compress_threshold bytes it gets gzip compressed
+class OutputBuffer():
+    def __init__(self, name:str, compress_threshold:int=1024 * 1024) -> None:
+        self.name = name
+        self.compress_threshold = compress_threshold
+        self.buffer = io.BytesIO()
+        self.gzip_file : Optional[gzip.GzipFile] = None
+        # Characters written so far
+        self.size = 0
+
+    # Whether the output is being compressed
+    @property
+    def compressed(self) -> bool:
+        return self.gzip_file is not None
+
+    # Adds output to the buffer
+    def write(self, content:str) -> None:
+        self.size += len(content)
+        data = content.encode(errors="replace")
+
+        if not self.compressed and self.buffer.tell() + len(data) > self.compress_threshold:
+            # Moves everything written so far into a compressed buffer
+            plain = self.buffer.getvalue()
+            self.buffer = io.BytesIO()
+            self.gzip_file = gzip.GzipFile(filename=f"{self.name}.txt", mode="wb", fileobj=self.buffer)
+            self.gzip_file.write(plain)
+
+        if self.compressed:
+            self.gzip_file.write(data)
+        else:
+            self.buffer.write(data)
+
+    # Returns the output as attachments of at most max_size bytes each
+    # Split compressed output has to be joined again before it can be decompressed
+    def files(self, max_size:int) -> List[discord.File]:
+        if self.compressed:
+            self.gzip_file.close()
+            extension = "txt.gz"
+        else:
+            extension = "txt"
+
+        data = self.buffer.getbuffer()
+        if len(data) <= max_size:
+            return [discord.File(io.BytesIO(data), filename=f"{self.name}.{extension}")]
+
+        files = []
+        for part, start in enumerate(range(0, len(data), max_size), start=1):
+            files.append(discord.File(io.BytesIO(data[start:start + max_size]), filename=f"{self.name}.{extension}.part{part}"))
+
+        return files
@@ -0,0 +1,149 @@
+import asyncio
+import codecs
+import os
+import pwd
+import signal
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+
+DEFAULT_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+# Characters of every stream that are kept for the result, the full output only passes through lines()
+OUTPUT_TAIL_SIZE = 1024 * 1024
+
+
+# Returns the options to start a process as a user with the environment of a login
+def user_options(user:str, allow_root:bool=True) -> dict:
+    try:
+        entry = pwd.getpwnam(user)
+    except KeyError:
+        raise PermissionError(f"The user '{user}' does not exist")
+
+    if entry.pw_uid == 0 and not allow_root:
+        raise PermissionError("Running commands as root has to be allowed explicitly")
+
+    options = {"env": {"HOME": entry.pw_dir, "USER": entry.pw_name, "LOGNAME": entry.pw_name, "SHELL": entry.pw_shell, "PATH": DEFAULT_PATH}}
+
+    # Switching users is only needed and possible as root
+    if entry.pw_uid != os.getuid():
+        options["user"] = entry.pw_uid
+        options["group"] = entry.pw_gid
+        options["extra_groups"] = os.getgrouplist(entry.pw_name, entry.pw_gid)
+
+    return options
+
+
+# Class that keeps the last max_size characters of a stream
+class OutputTail():
+    def __init__(self, max_size:int=OUTPUT_TAIL_SIZE) -> None:
+        self.max_size = max_size
+        self.lines : Deque[str] = deque()
+        self.size = 0
+
+    def add(self, line:str) -> None:
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_size and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft())
+
+    def __str__(self) -> str:
+        return "".join(self.lines)[-self.max_size:]
+
+
+# Class for a running process which output can be read line by line
+# options are passed on to the subprocess, for example cwd, env or user
+class Process():
+    def __init__(self, command_array:List[str], shell:bool=False, **options) -> None:
+        self.command_array = command_array
+        self.shell = shell
+        self.options = options
+        self.process : Optional[asyncio.subprocess.Process] = None
+        self.returncode : Optional[int] = None
+        self.output : Dict[str, OutputTail] = {"stdout": OutputTail(), "stderr": OutputTail()}
+
+    # The end of the stdout that has been read so far
+    @property
+    def stdout(self) -> str:
+        return str(self.output["stdout"])
+
+    # The end of the stderr that has been read so far
+    @property
+    def stderr(self) -> str:
+        return str(self.output["stderr"])
+
+    # Starts the process without blocking the event loop
+    # The process gets its own process group so everything it starts can be stopped with it
+    async def start(self) -> None:
+        if self.shell:
+            self.process = await asyncio.create_subprocess_shell(" ".join(self.command_array), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True, **self.options)
+        else:
+            self.process = await asyncio.create_subprocess_exec(*self.command_array, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True, **self.options)
+
+    # Sends a signal to the process group
+    def signal_group(self, signal_number:int) -> None:
+        try:
+            os.killpg(self.process.pid, signal_number)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    # Stops the process group, everything that is still running after grace seconds gets killed
+    async def kill(self, grace:float=5) -> None:
+        if self.process is None:
+            return
+
+        self.signal_group(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.process.wait(), grace)
+        except asyncio.TimeoutError:
+            pass
+
+        # Children that ignored SIGTERM can still be in the group after the process itself stopped
+        self.signal_group(signal.SIGKILL)
+        self.returncode = await self.process.wait()
+
+    # Reads a pipe in chunks and puts every complete line in the queue
+    # Chunks are used instead of readline so a very long line can't overrun the stream limit
+    async def read_pipe(self, pipe:asyncio.StreamReader, name:str, queue:asyncio.Queue) -> None:
+        # The incremental decoder keeps characters that are split over two chunks intact
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        while True:
+            chunk = await pipe.read(4096)
+            if not chunk:
+                buffer += decoder.decode(b"", final=True)
+                break
+
+            buffer += decoder.decode(chunk)
+            while "\n" in buffer:
+                index = buffer.index("\n") + 1
+                await queue.put((name, buffer[:index]))
+                buffer = buffer[index:]
+
+        if buffer != "":
+            await queue.put((name, buffer))
+        await queue.put(None)
+
+    # Yields (stream name, line) for both pipes as soon as a line is available
+    # The return code is set once both pipes are closed
+    async def lines(self) -> AsyncIterator[Tuple[str, str]]:
+        queue = asyncio.Queue()
+        readers = [
+            asyncio.create_task(self.read_pipe(self.process.stdout, "stdout", queue)),
+            asyncio.create_task(self.read_pipe(self.process.stderr, "stderr", queue))
+        ]
+
+        try:
+            open_pipes = len(readers)
+            while open_pipes > 0:
+                item = await queue.get()
+                if item is None:
+                    open_pipes -= 1
+                    continue
+
+                self.output[item[0]].add(item[1])
+                yield item
+        finally:
+            for reader in readers:
+                reader.cancel()
+
+        self.returncode = await self.process.wait()
@@ -0,0 +1,215 @@
+import asyncio
+import socket
+import struct
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from server import Server
+
+
+# Packets used by the query protocols
+A2S_HEADER = b"\xFF\xFF\xFF\xFF"
+A2S_INFO_REQUEST = A2S_HEADER + b"TSource Engine Query\x00"
+QUAKE3_REQUEST = A2S_HEADER + b"getstatus\n"
+
+
+###########
+#  Utils  #
+###########
+
+
+# Reads a null terminated string from a packet
+def read_string(data:bytes, offset:int) -> Tuple[str, int]:
+    end = data.index(b"\x00", offset)
+    return data[offset:end].decode(errors="replace"), end + 1
+
+# Handles a Source A2S_INFO response
+def handle_a2s(data:bytes) -> Tuple[Optional[bytes], Optional[dict]]:
+    if not data.startswith(A2S_HEADER):
+        raise ValueError("Not an A2S packet")
+
+    # Servers ask for the challenge to be added to the request
+    if data[4:5] == b"A":
+        return A2S_INFO_REQUEST + data[5:9], None
+
+    if data[4:5] != b"I":
+        raise ValueError("Not an A2S_INFO response")
+
+    offset = 6
+    name, offset = read_string(data, offset)
+    map_name, offset = read_string(data, offset)
+    _, offset = read_string(data, offset)
+    _, offset = read_string(data, offset)
+    # The id of the game comes before the player counts
+    offset += 2
+    players, max_players, bots = struct.unpack_from("<BBB", data, offset)
+
+    return None, {"name": name, "map": map_name, "players": players, "max players": max_players, "bots": bots}
+
+# Handles a Quake 3 getstatus response, used by the id Tech 3 games
+def handle_quake3(data:bytes) -> Tuple[Optional[bytes], Optional[dict]]:
+    if not data.startswith(A2S_HEADER + b"statusResponse"):
+        raise ValueError("Not a Quake 3 status response")
+
+    lines = data[4:].decode(errors="replace").split("\n")
+    values = lines[1].split("\\")[1:]
+    info = dict(zip(values[0::2], values[1::2]))
+    players = len([line for line in lines[2:] if line != ""])
+
+    return None, {"name": info.get("sv_hostname", ""), "map": info.get("mapname", ""), "players": players, "max players": int(info.get("sv_maxclients", 0)), "bots": 0}
+
+# Every protocol has a request and a handler
+# The handler returns a packet to send again (for challenges) or the parsed status
+protocols : Dict[str, Tuple[bytes, Callable[[bytes], Tuple[Optional[bytes], Optional[dict]]]]] = {
+    "a2s": (A2S_INFO_REQUEST, handle_a2s),
+    "quake3": (QUAKE3_REQUEST, handle_quake3)
+}
+
+
+##############
+#  Protocol  #
+##############
+
+
+# One socket for every query, the responses are matched by address
+class QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.transport : Optional[asyncio.DatagramTransport] = None
+        self.pending : Dict[Tuple[str, int], Tuple[Callable, asyncio.Future]] = {}
+
+    def connection_made(self, transport:asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data:bytes, addr:Tuple[str, int]) -> None:
+        pending = self.pending.get(addr[:2])
+        if pending is None or pending[1].done():
+            return
+
+        handler, future = pending
+        try:
+            resend, status = handler(data)
+        except (ValueError, IndexError, struct.error) as error:
+            future.set_exception(error)
+            return
+
+        if resend is not None:
+            self.transport.sendto(resend, addr)
+        else:
+            future.set_result(status)
+
+    # Unreachable servers are handled by the timeout
+    def error_received(self, exc:Exception) -> None:
+        pass
+
+    # Queries a single server
+    async def query(self, address:Tuple[str, int], protocol:str, timeout:float) -> dict:
+        request, handler = protocols[protocol]
+        future = asyncio.get_running_loop().create_future()
+        self.pending[address] = (handler, future)
+        try:
+            self.transport.sendto(request, address)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if self.pending.get(address, (None, None))[1] is future:
+                del self.pending[address]
+
+
+############
+#  Poller  #
+############
+
+
+# Class for the last known status of a game server
+class ServerStatus():
+    def __init__(self, online:bool, time:float, latency:float=0, map_name:str="", players:int=0, max_players:int=0) -> None:
+        self.online = online
+        self.time = time
+        self.latency = latency
+        self.map = map_name
+        self.players = players
+        self.max_players = max_players
+
+
+# Class that queries every game server in the background and caches the results
+class StatusPoller():
+    def __init__(self, interval:int, ttl:Optional[int]=None, timeout:float=2, max_queries:int=256) -> None:
+        self.interval = interval
+        self.ttl = ttl if ttl is not None else interval * 2
+        self.timeout = timeout
+        self.max_queries = max_queries
+        self.statuses : Dict[str, ServerStatus] = {}
+        self.addresses : Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self.task : Optional[asyncio.Task] = None
+
+    # Returns the cached status of a server if it isn't too old
+    def get(self, server:Server) -> Optional[ServerStatus]:
+        status = self.statuses.get(server.name)
+        if status is None or asyncio.get_running_loop().time() - status.time > self.ttl:
+            return None
+
+        return status
+
+    # Resolves a host once, game servers don't change address often
+    async def resolve(self, host:str, port:int) -> Tuple[str, int]:
+        if (host, port) not in self.addresses:
+            info = await asyncio.get_running_loop().getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            self.addresses[(host, port)] = info[0][4][:2]
+
+        return self.addresses[(host, port)]
+
+    # Queries one game server and caches the result for every server that uses it
+    async def poll_server(self, protocol:QueryProtocol, query:Tuple[str, int, str], names:List[str], semaphore:asyncio.Semaphore) -> None:
+        loop = asyncio.get_running_loop()
+        host, port, protocol_name = query
+        async with semaphore:
+            start = loop.time()
+            try:
+                address = await self.resolve(host, port)
+                info = await protocol.query(address, protocol_name, self.timeout)
+            except (OSError, ValueError, IndexError, struct.error, asyncio.TimeoutError):
+                status = ServerStatus(False, loop.time())
+            else:
+                status = ServerStatus(True, loop.time(), loop.time() - start, info["map"], info["players"], info["max players"])
+
+        for name in names:
+            self.statuses[name] = status
+
+    # Queries every server that has a query address at the same time
+    async def poll(self, servers:Iterable[Server]) -> None:
+        servers = [server for server in servers if server.query is not None]
+        if len(servers) == 0:
+            return
+
+        # Every address only gets queried once, even if several servers use it
+        queries : Dict[Tuple[str, int, str], List[str]] = {}
+        for server in servers:
+            queries.setdefault(server.query, []).append(server.name)
+
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(QueryProtocol, local_addr=("0.0.0.0", 0))
+        try:
+            semaphore = asyncio.Semaphore(self.max_queries)
+            await asyncio.gather(*[self.poll_server(protocol, query, names, semaphore) for query, names in queries.items()])
+        finally:
+            transport.close()
+
+        # Forgets the servers that were removed
+        names = set(server.name for server in servers)
+        for name in list(self.statuses):
+            if name not in names:
+                del self.statuses[name]
+
+    # Starts polling, get_servers returns the current servers
+    def start(self, get_servers:Callable[[], List[Server]]) -> None:
+        if self.task is None and self.interval > 0:
+            self.task = asyncio.create_task(self.run(get_servers))
+
+    # Stops polling
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self, get_servers:Callable[[], List[Server]]) -> None:
+        while True:
+            await self.poll(get_servers())
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from discord.ext import commands
+
+from config_parser import check_paths, config_hash, parse_command, parse_server, save_snapshot, server_path_checks, server_paths
+from server import Server
+from utils import print_to_console
+
+
+COMMANDS_FILE = "./configs/commands.json"
+SERVERS_FILE = "./configs/servers.json"
+
+
+# Class that watches commands.json and servers.json and only reparses what changed
+# path_checks are the results of the path checks the servers were parsed with
+class ConfigReloader():
+    def __init__(self, bot:commands.Bot, template_commands:dict, interval:int, path_checks:Optional[Dict[str, Tuple[bool, bool]]]=None) -> None:
+        self.bot = bot
+        self.interval = interval
+        self.template_commands = template_commands
+        self.path_checks = path_checks or {}
+        self.file_stats : Dict[str, Tuple[int, int]] = {}
+        self.commands_data : dict = {}
+        self.servers_data : dict = {}
+        self.servers_by_key : Dict[str, Server] = {}
+        self.lock = asyncio.Lock()
+        self.task : Optional[asyncio.Task] = None
+
+        self.file_stats = {COMMANDS_FILE: self.stat(COMMANDS_FILE), SERVERS_FILE: self.stat(SERVERS_FILE)}
+        self.commands_data = self.load(COMMANDS_FILE) or {}
+        self.servers_data = self.load(SERVERS_FILE) or {}
+
+        # Links the parsed servers to their key in servers.json
+        servers_by_name = {server.name: server for server in self.bot.servers}
+        for key, server_data in self.servers_data.items():
+            if isinstance(server_data, dict) and server_data.get("name") in servers_by_name:
+                self.servers_by_key[key] = servers_by_name[server_data["name"]]
+
+
+    ###########
+    #  Utils  #
+    ###########
+
+
+    # Returns the modification time and size of a file
+    def stat(self, file_location:str) -> Tuple[int, int]:
+        try:
+            stat = os.stat(file_location)
+        except FileNotFoundError:
+            return 0, 0
+
+        return stat.st_mtime_ns, stat.st_size
+
+    # Reads a json file, unlike read_file a broken file doesn't stop the bot
+    def load(self, file_location:str) -> Optional[dict]:
+        try:
+            with open(file_location) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError) as error:
+            print_to_console(f"Could not reload {file_location} because '{error}'. The current config is kept.")
+            return None
+
+    # Returns the files that changed since the last reload
+    def changed_files(self) -> List[str]:
+        return [file_location for file_location, stat in self.file_stats.items() if self.stat(file_location) != stat]
+
+
+    ############
+    #  Reload  #
+    ############
+
+
+    # Parses everything that changed, doesn't touch the running bot
+    # With recheck the paths of every server are checked again, so scripts that were added or removed are noticed
+    # Runs in a thread as it does file system checks
+    def collect_changes(self, files:List[str], recheck:bool=False) -> Optional[tuple]:
+        file_stats = {file_location: self.stat(file_location) for file_location in files}
+        # Hashed before reading so a snapshot never claims to be newer than its content
+        content_hash = config_hash()
+
+        # Only the command templates that changed get parsed again
+        template_commands = self.template_commands
+        commands_data = self.commands_data
+        changed_templates : Set[str] = set()
+        if COMMANDS_FILE in files:
+            commands_data = self.load(COMMANDS_FILE)
+            if commands_data is None:
+                return None
+
+            template_commands = {}
+            for name in set(commands_data) | set(self.commands_data):
+                if name in commands_data and commands_data[name] == self.commands_data.get(name):
+                    if name in self.template_commands:
+                        template_commands[name] = self.template_commands[name]
+                    continue
+
+                changed_templates.add(name)
+                if name in commands_data:
+                    template = parse_command(name, commands_data[name])
+                    if template is not None:
+                        template_commands[name] = template
+
+        servers_data = self.servers_data
+        if SERVERS_FILE in files:
+            servers_data = self.load(SERVERS_FILE)
+            if servers_data is None:
+                return None
+
+        # Only the servers that changed or use a changed template get parsed again
+        changed_keys = set()
+        for key, server_data in servers_data.items():
+            uses_changed_template = isinstance(server_data, dict) and isinstance(server_data.get("commands"), dict) and any(
+                isinstance(command, dict) and command.get("command") in changed_templates for command in server_data["commands"].values()
+            )
+            if key not in self.servers_data or server_data != self.servers_data[key] or uses_changed_template:
+                changed_keys.add(key)
+
+        if recheck:
+            path_checks = server_path_checks(servers_data, template_commands)
+            # Servers whose paths give another result than when they were parsed get parsed again
+            for key, server_data in servers_data.items():
+                if any(path_checks[path] != self.path_checks.get(path) for path in server_paths(server_data, template_commands)):
+                    changed_keys.add(key)
+        else:
+            path_checks = {**self.path_checks, **check_paths(path for key in changed_keys for path in server_paths(servers_data[key], template_commands))}
+        # Only the paths of the current servers are kept
+        path_checks = {path: path_checks[path] for key in servers_data for path in server_paths(servers_data[key], template_commands) if path in path_checks}
+
+        servers_by_key = {}
+        server_names = set()
+        for key, server_data in servers_data.items():
+            if key not in changed_keys:
+                old_server = self.servers_by_key.get(key)
+                if old_server is not None and old_server.name not in server_names:
+                    servers_by_key[key] = old_server
+                    server_names.add(old_server.name)
+                continue
+
+            server = parse_server(key, server_data, template_commands, server_names, path_checks)
+            if server is not None:
+                servers_by_key[key] = server
+                server_names.add(server.name)
+
+        if len(servers_by_key) == 0:
+            print_to_console("The reloaded config has no servers with any valid commands. The current config is kept.")
+            return None
+
+        return file_stats, commands_data, template_commands, servers_data, servers_by_key, content_hash, path_checks
+
+    # Patches the new servers into the running bot without reloading the cog
+    def apply(self, changes:tuple) -> Tuple[int, int, int]:
+        file_stats, commands_data, template_commands, servers_data, servers_by_key, _, path_checks = changes
+
+        added = len(servers_by_key.keys() - self.servers_by_key.keys())
+        removed = len(self.servers_by_key.keys() - servers_by_key.keys())
+        changed = len([key for key in servers_by_key.keys() & self.servers_by_key.keys() if servers_by_key[key] is not self.servers_by_key[key]])
+
+        # Cached results of servers that were replaced or removed could be from another path or command
+        for key, server in self.servers_by_key.items():
+            if servers_by_key.get(key) is not server:
+                self.bot.result_cache.clear_server(server.name)
+
+        self.file_stats.update(file_stats)
+        self.commands_data = commands_data
+        self.template_commands = template_commands
+        self.servers_data = servers_data
+        self.servers_by_key = servers_by_key
+        self.path_checks = path_checks
+
+        # The list and dict are changed in place so everything holding on to them sees the new servers
+        self.bot.servers[:] = servers_by_key.values()
+        cog = self.bot.get_cog("Commands")
+        if cog is not None:
+            cog.servers.clear()
+            cog.servers.update({server.name: server for server in self.bot.servers})
+
+        return added, changed, removed
+
+    # Reloads the changed files
+    # With force both files are reloaded and the paths of every server are checked again
+    # Returns the amount of added, changed and removed servers or None if nothing was reloaded
+    async def reload(self, force:bool=False) -> Optional[Tuple[int, int, int]]:
+        async with self.lock:
+            files = list(self.file_stats) if force else self.changed_files()
+            if len(files) == 0:
+                return None
+
+            start = time.monotonic()
+
+            changes = await asyncio.get_running_loop().run_in_executor(None, self.collect_changes, files, force)
+            if changes is None:
+                # Doesn't try the same broken file again until it changes
+                self.file_stats.update({file_location: self.stat(file_location) for file_location in files})
+                return None
+
+            result = self.apply(changes)
+            # Next start can skip parsing the config again
+            await asyncio.get_running_loop().run_in_executor(None, save_snapshot, changes[5], self.template_commands, list(self.bot.servers), self.path_checks)
+            self.bot.metrics.observe_reload(time.monotonic() - start)
+
+            return result
+
+
+    ###########
+    #  Watch  #
+    ###########
+
+
+    # Starts watching the config files
+    def start(self) -> None:
+        if self.task is None and self.interval > 0:
+            self.task = asyncio.create_task(self.watch())
+
+    # Stops watching the config files
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    # Polls the modification times of the config files
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            result = await self.reload()
+            if result is not None:
+                print_to_console(f"Reloaded the config: {result[0]} added, {result[1]} changed and {result[2]} removed server(s)")
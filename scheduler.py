@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Set
+
+
+# Class for a job that is waiting for or holding a slot
+class Job():
+    def __init__(self, server:str) -> None:
+        self.server = server
+        self.started = asyncio.Event()
+        self.changed = asyncio.Event()
+
+    # Waits until the queue has moved or cancel gets set
+    async def wait_for_change(self, cancel:Optional[asyncio.Event]=None) -> None:
+        waiters = [asyncio.ensure_future(self.changed.wait())]
+        if cancel is not None:
+            waiters.append(asyncio.ensure_future(cancel.wait()))
+
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        self.changed.clear()
+
+
+# Class that runs at most one job per server and a limited amount of jobs in total
+class Scheduler():
+    def __init__(self, max_jobs:int) -> None:
+        self.max_jobs = max_jobs
+        self.queue : List[Job] = []
+        self.running : Set[Job] = set()
+        self.busy_servers : Set[str] = set()
+
+    # Amount of jobs waiting for a slot
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    # Returns the queue position of a job, 0 if it's running
+    def position(self, job:Job) -> int:
+        try:
+            return self.queue.index(job) + 1
+        except ValueError:
+            return 0
+
+    # Adds a job to the queue
+    def submit(self, server:str) -> Job:
+        job = Job(server)
+        self.queue.append(job)
+        self.dispatch()
+
+        return job
+
+    # Releases the slot of a job or removes it from the queue
+    def finish(self, job:Job) -> None:
+        if job in self.running:
+            self.running.remove(job)
+            self.busy_servers.discard(job.server)
+        elif job in self.queue:
+            self.queue.remove(job)
+
+        self.dispatch()
+
+    # Starts every job that is allowed to run in order of the queue
+    def dispatch(self) -> None:
+        for job in self.queue.copy():
+            if len(self.running) >= self.max_jobs:
+                break
+
+            if job.server in self.busy_servers:
+                continue
+
+            self.queue.remove(job)
+            self.running.add(job)
+            self.busy_servers.add(job.server)
+            job.started.set()
+            job.changed.set()
+
+        # Lets the waiting jobs know their position might have changed
+        for job in self.queue:
+            job.changed.set()
+
+    # Waits for a slot for the server and holds it for the duration of the block
+    # on_queued gets called with the queue position while waiting and with 0 once the job has started
+    # When cancel gets set while waiting the job leaves the queue and the block runs without a slot, job.started isn't set then
+    @asynccontextmanager
+    async def slot(self, server:str, on_queued:Optional[Callable[[int], Awaitable[None]]]=None, cancel:Optional[asyncio.Event]=None) -> AsyncIterator[Job]:
+        job = self.submit(server)
+        try:
+            if not job.started.is_set():
+                last_position = 0
+                while not job.started.is_set():
+                    if cancel is not None and cancel.is_set():
+                        self.finish(job)
+                        break
+
+                    # Only reports the position when it actually changed
+                    position = self.position(job)
+                    if on_queued is not None and position != last_position:
+                        await on_queued(position)
+                        last_position = position
+                    await job.wait_for_change(cancel)
+
+                if on_queued is not None and job.started.is_set():
+                    await on_queued(0)
+
+            yield job
+        finally:
+            self.finish(job)
@@ -1,9 +1,20 @@
-from typing import List, Optional, Tuple
+import time
+from asyncio import Event
+from types import MappingProxyType
+from typing import Awaitable, Callable, List, Mapping, Optional, Tuple
 
 from discord import Member, TextChannel
 from discord.ext.commands import Bot
 
-from command import Command
+from command import Command, CommandResult
+from timing import StageTimer
+
+
+# Staff roles, every role can also use the commands of the roles below it
+NO_ROLE = 0
+MODERATOR = 1
+ADMIN = 2
+HEAD_ADMIN = 3
 
 
 # Class for the different servers
@@ -11,53 +22,183 @@ class Server():
     def __init__(self, name:str, path:str) -> None:
         self.name : str = name
         self.path : str = path
+        # Host, port and protocol to query the status of the game server
+        self.query : Optional[Tuple[str, int, str]] = None
+        # Category to run commands on a group of servers
+        self.category : Optional[str] = None
+        # Name of the node in settings.json whose agent runs the commands, None for this host
+        self.node : Optional[str] = None
         self.head_admin_commands : List[Command] = []
         self.admin_commands : List[Command] = []
         self.moderator_commands : List[Command] = []
         self.all_commands : List[Command] = []
+        self.role_commands : Optional[Mapping[int, Tuple[Command, ...]]] = None
+        self.command_roles : Optional[Mapping[Command, int]] = None
 
     # Makes sure each command is unique 
+    # Adding a command invalidates the permission index
     def add_head_admin_command(self, command:Command) -> None:
         if command not in self.admin_commands and command not in self.moderator_commands:
             self.head_admin_commands.append(command)
             self.all_commands.append(command)
+            self.role_commands = self.command_roles = None
 
     def add_admin_command(self, command:Command) -> None:
         if command not in self.moderator_commands:
             self.admin_commands.append(command)
             self.all_commands.append(command)
+            self.role_commands = self.command_roles = None
 
     def add_moderator_command(self, command:Command) -> None:
             self.moderator_commands.append(command)
             self.all_commands.append(command)
+            self.role_commands = self.command_roles = None
+
+    # Builds the permission index so lookups don't have to go through the command lists
+    def build_permissions(self) -> None:
+        command_roles = {}
+        for role, commands in ((MODERATOR, self.moderator_commands), (ADMIN, self.admin_commands), (HEAD_ADMIN, self.head_admin_commands)):
+            for command in commands:
+                if command not in command_roles:
+                    command_roles[command] = role
+
+        moderator = tuple(self.moderator_commands)
+        admin = tuple(x for x in self.admin_commands if command_roles[x] == ADMIN) + moderator
+        head_admin = tuple(x for x in self.head_admin_commands if command_roles[x] == HEAD_ADMIN) + admin
+
+        self.command_roles = MappingProxyType(command_roles)
+        self.role_commands = MappingProxyType({MODERATOR: moderator, ADMIN: admin, HEAD_ADMIN: head_admin})
+
+    # The read only views of the permission index can't be pickled for the config snapshot
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for name in ("role_commands", "command_roles"):
+            if state[name] is not None:
+                state[name] = dict(state[name])
+
+        return state
+
+    def __setstate__(self, state:dict) -> None:
+        for name in ("role_commands", "command_roles"):
+            if state[name] is not None:
+                state[name] = MappingProxyType(state[name])
+        self.__dict__.update(state)
+
+    # Returns all the commands a role can use
+    def commands_for(self, role:int) -> Tuple[Command, ...]:
+        if self.role_commands is None:
+            self.build_permissions()
+
+        return self.role_commands.get(role, ())
+
+    # Checks if a role can use a command
+    def can_use(self, command:Command, role:int) -> bool:
+        if self.command_roles is None:
+            self.build_permissions()
+
+        required_role = self.command_roles.get(command)
+        return required_role is not None and role >= required_role
+
+    # Returns the command made from a commands.json entry if the role can use it
+    def command_for_template(self, template:str, role:int) -> Optional[Command]:
+        for command in self.commands_for(role):
+            if command.template == template:
+                return command
+
+        return None
 
     # Returns all the commands a head admin can use
     @property
-    def head_admin(self) -> List[Command]:
-        commands = [x for x in self.head_admin_commands]
-        [commands.append(x) for x in self.admin_commands if x not in commands]
-        [commands.append(x) for x in self.moderator_commands if x not in commands]
-
-        return commands
+    def head_admin(self) -> Tuple[Command, ...]:
+        return self.commands_for(HEAD_ADMIN)
 
     # Returns all the commands an admin can use
     @property
-    def admin(self) -> List[Command]:
-        commands = [x for x in self.admin_commands]
-        [commands.append(x) for x in self.moderator_commands if x not in commands]
-
-        return commands
+    def admin(self) -> Tuple[Command, ...]:
+        return self.commands_for(ADMIN)
 
     # Returns all the commands a moderator can use
     @property
-    def moderator(self) -> List[Command]:
-        return self.moderator_commands
+    def moderator(self) -> Tuple[Command, ...]:
+        return self.commands_for(MODERATOR)
 
     # Executes the commands
-    async def execute_command(self, bot:Bot, user_command:Command, channel:TextChannel, author:Member) -> Tuple[bool, Optional[str], Optional[str], Optional[bool]]:
-        for command in self.all_commands:
-            if command == user_command:
-                result = await command.execute(bot, channel, author)
+    # The arguments are asked before queueing so waiting for the user doesn't hold a slot
+    async def execute_command(self, bot:Bot, user_command:Command, channel:TextChannel, author:Member, on_queued:Optional[Callable[[int], Awaitable[None]]]=None, on_line:Optional[Callable[[str, str], None]]=None, timer:Optional[StageTimer]=None, cancel:Optional[Event]=None) -> CommandResult:
+        if timer is None:
+            timer = StageTimer()
+
+        if self.command_roles is None:
+            self.build_permissions()
+
+        if user_command not in self.command_roles:
+            return CommandResult(False, None, None)
+
+        with timer.stage("input wait"):
+            input_result = await user_command.get_arguments(bot, channel, author)
+        if not input_result[0]:
+            return CommandResult(False, None, None, True)
+
+        return await self.run_command(bot, user_command, input_result[1], author, on_queued, on_line, timer, cancel)
+
+    # Runs a command with arguments that are already known
+    # Read only commands are served from the cache while their result is young enough
+    # Requests for a command that is already running with the same arguments get its result
+    async def run_command(self, bot:Bot, user_command:Command, arguments:List[str], author:Member, on_queued:Optional[Callable[[int], Awaitable[None]]]=None, on_line:Optional[Callable[[str, str], None]]=None, timer:Optional[StageTimer]=None, cancel:Optional[Event]=None) -> CommandResult:
+        if timer is None:
+            timer = StageTimer()
+
+        start = time.monotonic()
+        cache_key = (self.name, user_command.key, tuple(arguments))
+        if user_command.cache_ttl > 0:
+            result = bot.result_cache.get(cache_key, user_command.cache_ttl)
+            if result is not None:
+                self.record_execution(bot, user_command, author, arguments, result, start, False)
                 return result
 
-        return False, None, None
+        if self.node is None:
+            agent = bot.agent
+        elif self.node in bot.nodes:
+            agent = bot.nodes[self.node]
+        else:
+            return CommandResult(False, "", f"The node `{self.node}` of `{self.name}` is not in settings.json")
+
+        # Identical requests that are already running share the execution
+        async def execute(on_queued:Callable[[int], Awaitable[None]], on_line:Callable[[str, str], None], cancel:Event) -> CommandResult:
+            queued = time.perf_counter()
+            async with bot.scheduler.slot(self.name, on_queued, cancel) as job:
+                timer.add("queue wait", time.perf_counter() - queued)
+                # Cancelled while waiting in the queue
+                if not job.started.is_set() or cancel.is_set():
+                    return CommandResult(False, "", "", stopped="cancelled")
+                result = await user_command.execute(arguments, on_line, timer, cancel, agent)
+
+            if user_command.cache_ttl > 0 and result.ok:
+                bot.result_cache.put(cache_key, result)
+
+            return result
+
+        shared = cache_key in bot.single_flight
+        result = await bot.single_flight.run(cache_key, execute, on_queued, on_line, cancel)
+        self.record_execution(bot, user_command, author, arguments, result, start, shared)
+
+        return result
+
+    # Adds an execution to the audit log and the metrics
+    def record_execution(self, bot:Bot, user_command:Command, author:Member, arguments:List[str], result:CommandResult, start:float, shared:bool) -> None:
+        duration = time.monotonic() - start
+        bot.metrics.observe_command(self.name, user_command.name, duration)
+        bot.audit_log.record({
+            "event": "command",
+            "user": author.id,
+            "user_name": str(author),
+            "server": self.name,
+            "command": user_command.name,
+            "arguments": arguments,
+            "exit_code": result.returncode,
+            "ok": result.ok,
+            "duration": round(duration, 3),
+            "output_size": len(result.stdout or "") + len(result.stderr or ""),
+            "cached": result.cache_age is not None,
+            "shared": shared
+        })
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Makes the bot modules importable when pytest is run without python -m
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
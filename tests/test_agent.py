@@ -0,0 +1,139 @@
+import asyncio
+import os
+import pwd
+import socket
+from typing import List, Tuple
+
+import pytest
+
+from agent import Agent, AgentClient, AgentPool, encode_frame
+
+
+TOKEN = "a-token-for-the-tests"
+# The agents may only run commands as the user running the tests
+USER = pwd.getpwuid(os.getuid()).pw_name
+
+
+###########
+#  Utils  #
+###########
+
+
+# Returns a tcp port nothing is listening on
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Starts an agent that listens on tcp and waits until it accepts connections
+async def start_agent(port:int, token:str=TOKEN) -> asyncio.Task:
+    agent = Agent("", set(), {USER}, "127.0.0.1", port, token)
+    task = asyncio.create_task(agent.serve())
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.02)
+            continue
+        writer.close()
+        return task
+
+    raise TimeoutError(f"The agent on port {port} did not start")
+
+# Stops the agents from accepting connections
+async def stop_agents(tasks:List[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# Runs a command through an agent and returns its stdout and return code
+async def run(client, argv:List[str]) -> Tuple[str, int]:
+    process = client.process(argv, "/", USER)
+    await process.start()
+    async for _ in process.lines():
+        pass
+
+    return process.stdout, process.returncode
+
+
+###########
+#  Tests  #
+###########
+
+
+# Two nodes on one host, every pool only talks to its own agent
+def test_two_agents() -> None:
+    async def test() -> None:
+        ports = [free_port(), free_port()]
+        agents = [await start_agent(ports[0]), await start_agent(ports[1], TOKEN + "-2")]
+        pools = [AgentPool("127.0.0.1", ports[0], TOKEN), AgentPool("127.0.0.1", ports[1], TOKEN + "-2")]
+        try:
+            results = await asyncio.gather(*(run(pool, ["sh", "-c", f"echo node {number}; exit {number}"]) for number, pool in enumerate(pools)))
+        finally:
+            await asyncio.gather(*(pool.close() for pool in pools))
+            await stop_agents(agents)
+
+        assert results == [("node 0\n", 0), ("node 1\n", 1)]
+
+    asyncio.run(test())
+
+def test_wrong_token() -> None:
+    async def test() -> None:
+        port = free_port()
+        agents = [await start_agent(port)]
+        client = AgentClient(host="127.0.0.1", port=port, token="not-the-token")
+        try:
+            with pytest.raises(ConnectionError, match="token"):
+                await run(client, ["true"])
+            # It waits before trying again
+            with pytest.raises(ConnectionError, match="trying again"):
+                await run(client, ["true"])
+        finally:
+            await client.close()
+            await stop_agents(agents)
+
+    asyncio.run(test())
+
+# The client connects again once an agent is back or after the connection was lost
+def test_reconnect() -> None:
+    async def test() -> None:
+        port = free_port()
+        client = AgentClient(host="127.0.0.1", port=port, token=TOKEN)
+        agents = []
+        try:
+            with pytest.raises(ConnectionError, match="Could not connect"):
+                await run(client, ["true"])
+
+            agents.append(await start_agent(port))
+            await asyncio.sleep(client.retry_at - asyncio.get_running_loop().time())
+            assert await run(client, ["echo", "back"]) == ("back\n", 0)
+
+            client.writer.transport.abort()
+            await asyncio.sleep(0.1)
+            assert not client.connected
+            assert await run(client, ["echo", "again"]) == ("again\n", 0)
+        finally:
+            await client.close()
+            await stop_agents(agents)
+
+    asyncio.run(test())
+
+# Frames that aren't signed with the key of the session close the connection
+def test_unsigned_frame() -> None:
+    async def test() -> None:
+        port = free_port()
+        agents = [await start_agent(port)]
+        client = AgentClient(host="127.0.0.1", port=port, token=TOKEN)
+        marker = f"/tmp/agent-test-{os.getpid()}"
+        try:
+            await run(client, ["true"])
+            client.writer.write(encode_frame({"type": "run", "id": 1000, "argv": ["touch", marker], "cwd": "/", "user": USER}))
+            await asyncio.sleep(0.3)
+
+            assert not client.connected
+            assert not os.path.exists(marker)
+        finally:
+            await client.close()
+            await stop_agents(agents)
+
+    asyncio.run(test())
@@ -0,0 +1,127 @@
+import asyncio
+import socket
+import struct
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+from query import A2S_HEADER, A2S_INFO_REQUEST, QUAKE3_REQUEST, StatusPoller
+
+
+CHALLENGE = b"\x01\x02\x03\x04"
+
+
+###########
+#  Utils  #
+###########
+
+
+# Local stand-in for a game server that answers the A2S and Quake 3 queries
+class FakeGameServer(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.transport : Optional[asyncio.DatagramTransport] = None
+        self.requests : List[bytes] = []
+
+    def connection_made(self, transport:asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data:bytes, addr:Tuple[str, int]) -> None:
+        self.requests.append(data)
+        if data == A2S_INFO_REQUEST:
+            # Asks for the challenge to be added like newer Source servers do
+            self.transport.sendto(A2S_HEADER + b"A" + CHALLENGE, addr)
+        elif data == A2S_INFO_REQUEST + CHALLENGE:
+            info = A2S_HEADER + b"I\x11" + b"Arena\x00de_dust2\x00csgo\x00Counter-Strike\x00" + struct.pack("<hBBB", 730, 7, 16, 2)
+            self.transport.sendto(info, addr)
+        elif data == QUAKE3_REQUEST:
+            status = A2S_HEADER + b"statusResponse\n\\sv_hostname\\Quake\\mapname\\q3dm17\\sv_maxclients\\12\n0 50 \"one\"\n3 40 \"two\"\n"
+            self.transport.sendto(status, addr)
+
+# Starts a fake game server and returns its transport and port
+async def start_game_server() -> Tuple[asyncio.DatagramTransport, FakeGameServer, int]:
+    transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(FakeGameServer, local_addr=("127.0.0.1", 0))
+    return transport, protocol, transport.get_extra_info("sockname")[1]
+
+# Returns a udp port nothing is listening on
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Returns a server that is queried on the fake game server
+def make_server(name:str, port:int, protocol:str) -> SimpleNamespace:
+    return SimpleNamespace(name=name, query=("127.0.0.1", port, protocol))
+
+
+###########
+#  Tests  #
+###########
+
+
+def test_a2s_with_challenge() -> None:
+    async def run() -> None:
+        transport, game_server, port = await start_game_server()
+        try:
+            poller = StatusPoller(0, ttl=60, timeout=2)
+            server = make_server("arena", port, "a2s")
+            await poller.poll([server])
+            status = poller.get(server)
+        finally:
+            transport.close()
+
+        assert game_server.requests == [A2S_INFO_REQUEST, A2S_INFO_REQUEST + CHALLENGE]
+        assert status.online
+        assert (status.map, status.players, status.max_players) == ("de_dust2", 7, 16)
+
+    asyncio.run(run())
+
+def test_quake3() -> None:
+    async def run() -> None:
+        transport, _, port = await start_game_server()
+        try:
+            poller = StatusPoller(0, ttl=60, timeout=2)
+            server = make_server("quake", port, "quake3")
+            await poller.poll([server])
+            status = poller.get(server)
+        finally:
+            transport.close()
+
+        assert status.online
+        assert (status.map, status.players, status.max_players) == ("q3dm17", 2, 12)
+
+    asyncio.run(run())
+
+# Servers that share an address are queried once and get the same status
+def test_shared_address() -> None:
+    async def run() -> None:
+        transport, game_server, port = await start_game_server()
+        try:
+            poller = StatusPoller(0, ttl=60, timeout=2)
+            servers = [make_server("first", port, "quake3"), make_server("second", port, "quake3")]
+            await poller.poll(servers)
+        finally:
+            transport.close()
+
+        assert game_server.requests == [QUAKE3_REQUEST]
+        assert poller.get(servers[0]) is poller.get(servers[1])
+
+    asyncio.run(run())
+
+def test_offline_server_times_out() -> None:
+    async def run() -> None:
+        transport, _, port = await start_game_server()
+        try:
+            poller = StatusPoller(0, ttl=60, timeout=0.2)
+            online = make_server("online", port, "a2s")
+            offline = make_server("offline", free_port(), "a2s")
+            start = asyncio.get_running_loop().time()
+            await poller.poll([online, offline])
+            duration = asyncio.get_running_loop().time() - start
+        finally:
+            transport.close()
+
+        assert poller.get(online).online
+        assert not poller.get(offline).online
+        # The offline server doesn't hold up the others longer than the timeout
+        assert duration < 1
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import asyncio
+import heapq
+import itertools
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+# Class that keeps every timeout in one heap and wakes up once for the earliest one
+# Cancelled or rescheduled entries stay in the heap until they reach the top, which keeps both O(log n)
+class TimerHeap():
+    def __init__(self) -> None:
+        self.heap : List[Tuple[float, int, Hashable]] = []
+        self.timers : Dict[Hashable, Tuple[float, int, Callable[[], None]]] = {}
+        self.counter = itertools.count()
+        self.handle : Optional[asyncio.TimerHandle] = None
+        self.handle_deadline : Optional[float] = None
+
+    # Amount of live timers
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self.timers
+
+    # Calls callback after timeout seconds, replaces the current timer for the key
+    def schedule(self, key:Hashable, timeout:float, callback:Callable[[], None]) -> None:
+        deadline = asyncio.get_running_loop().time() + timeout
+        sequence = next(self.counter)
+        self.timers[key] = (deadline, sequence, callback)
+        heapq.heappush(self.heap, (deadline, sequence, key))
+
+        self.compact()
+        self.wake_up()
+
+    # Cancels the timer for a key
+    def cancel(self, key:Hashable) -> bool:
+        if self.timers.pop(key, None) is None:
+            return False
+
+        self.compact()
+        return True
+
+    # Removes the stale entries once they outnumber the live ones
+    def compact(self) -> None:
+        if len(self.heap) > 2 * len(self.timers) + 64:
+            self.heap = [(deadline, sequence, key) for key, (deadline, sequence, _) in self.timers.items()]
+            heapq.heapify(self.heap)
+
+    # Makes sure the loop wakes up for the earliest deadline
+    def wake_up(self) -> None:
+        if len(self.heap) == 0:
+            return
+
+        deadline = self.heap[0][0]
+        if self.handle is not None:
+            if self.handle_deadline <= deadline:
+                return
+            self.handle.cancel()
+
+        self.handle = asyncio.get_running_loop().call_at(deadline, self.expire)
+        self.handle_deadline = deadline
+
+    # Calls the callbacks of every timer that expired
+    def expire(self) -> None:
+        self.handle = None
+        self.handle_deadline = None
+        now = asyncio.get_running_loop().time()
+
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            deadline, sequence, key = heapq.heappop(self.heap)
+            timer = self.timers.get(key)
+            # Skips entries that were cancelled or rescheduled
+            if timer is None or timer[1] != sequence:
+                continue
+
+            del self.timers[key]
+            timer[2]()
+
+        self.wake_up()
@@ -0,0 +1,56 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Tuple
+
+
+# Stages of the path from a reaction to the result, in order
+STAGES = ("permission", "embed edit", "input wait", "queue wait", "spawn", "runtime", "result edit", "upload")
+
+
+# Class that times the stages of a single execution
+class StageTimer():
+    def __init__(self) -> None:
+        self.stages : Dict[str, float] = {}
+
+    # Times the block, a stage that runs multiple times gets added up
+    @contextmanager
+    def stage(self, name:str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name:str, seconds:float) -> None:
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    # Returns the stages in milliseconds, in order
+    def milliseconds(self) -> Dict[str, int]:
+        return {stage: round(self.stages[stage] * 1000) for stage in STAGES if stage in self.stages}
+
+    def render(self) -> str:
+        return " ▫️ ".join(f"{stage}: {milliseconds}ms" for stage, milliseconds in self.milliseconds().items())
+
+
+# Class that keeps the last timings of every stage
+class StageStats():
+    def __init__(self, size:int=1000) -> None:
+        self.size = size
+        self.samples : Dict[str, Deque[float]] = {stage: deque(maxlen=size) for stage in STAGES}
+
+    def record(self, timer:StageTimer) -> None:
+        for stage, seconds in timer.stages.items():
+            self.samples[stage].append(seconds)
+
+    # Returns the amount of samples and the 50th, 95th and 99th percentile in seconds
+    def summary(self, stage:str) -> Tuple[int, float, float, float]:
+        samples = sorted(self.samples[stage])
+        if len(samples) == 0:
+            return 0, 0.0, 0.0, 0.0
+
+        # Nearest rank
+        def percentile(percent:int) -> float:
+            return samples[max(0, -(-len(samples) * percent // 100) - 1)]
+
+        return len(samples), percentile(50), percentile(95), percentile(99)
@@ -46,7 +46,8 @@ async def send(bot:commands.Bot, channel:discord.TextChannel, description:str, t
     )
     embed.set_footer(text=footer)
     try:
-        msg = await channel.send(embed=embed, delete_after=delete_after)
+        with bot.metrics.discord_call("send"):
+            msg = await channel.send(embed=embed, delete_after=delete_after)
     except discord.errors.Forbidden:
         info = await bot.application_info()
         owner = info.owner